@@ -20,6 +20,19 @@ hiddenimports += [
     "requests",
     "uuid",
     "worker",
+    "render",
+    "scan_cache",
+    "copier",
+    "probe",
+    "manifest",
+    "journal",
+    "pipeline",
+    "records",
+    "resample",
+    "channel_layouts",
+    "loudness",
+    "sqlite3",
+    "multiprocessing",
     "utils",
     "datetime",
     "os",
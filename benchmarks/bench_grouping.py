@@ -0,0 +1,82 @@
+"""
+Compare utils.group_files_by_variation with utils.find_files_with_variations on synthetic file lists.
+
+python benchmarks/bench_grouping.py --files 1000000
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import utils
+
+
+def synthetic_tokens(number_of_files: int, run_length: int) -> dict:
+    """{path: tokens} like split_paths_to_tokens gives, in runs of run_length variations.
+    every 4th run is a single file with no variations. folders hold at least 50 files and never split a run.
+    """
+    path_and_tokens = {}
+    folder = Path("/library")
+    folder_size = max(50, run_length * 4)
+
+    for i in range(number_of_files):
+        if i % folder_size == 0:
+            folder = Path(f"/library/folder_{i // folder_size}")
+
+        run = i // run_length
+        if run % 4 == 3:
+            # a name without any numbers, so it can't be a variation
+            name = "".join(chr(97 + int(digit)) for digit in str(i))
+            path_and_tokens[folder / f"single sound {name}.wav"] = [
+                "single",
+                "sound",
+                name,
+            ]
+            continue
+
+        variation = i % run_length + 1
+        tokens = ["metal", "impact", str(run), "heavy", f"{variation:02d}"]
+        path_and_tokens[folder / f"metal impact {run} heavy_{variation:02d}.wav"] = (
+            tokens
+        )
+
+    return path_and_tokens
+
+
+def time_function(function, path_and_tokens: dict) -> tuple[float, int]:
+    start = time.perf_counter()
+    groups = function(path_and_tokens)
+    return time.perf_counter() - start, len(groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument(
+        "--run-length",
+        type=int,
+        nargs="+",
+        default=[5, 50, 1000],
+        help="number of variations in a row, long runs are where adjacent-pair comparison is O(n^2)",
+    )
+    args = parser.parse_args()
+
+    for run_length in args.run_length:
+        path_and_tokens = synthetic_tokens(args.files, run_length)
+
+        print(f"{args.files} files, runs of {run_length} variations")
+        for function in (
+            utils.find_files_with_variations,
+            utils.group_files_by_variation,
+        ):
+            seconds, number_of_groups = time_function(function, path_and_tokens)
+            print(
+                f"    {function.__name__:<28} {seconds:8.2f}s {number_of_groups} groups"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure resampling throughput of each quality tier, streamed in render.BLOCKSIZE blocks like file_append does,
+and how long it takes to set up a new soxr stream compared to clearing a cached one.
+
+python benchmarks/bench_resample.py
+python benchmarks/bench_resample.py --seconds 60 --channels 2 --rates 44100:48000 48000:96000
+"""
+
+from pathlib import Path
+import argparse
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import numpy
+import soxr
+
+import render
+import resample
+from records import RESAMPLE_QUALITIES
+
+
+def stream_through(
+    resampler: soxr.ResampleStream, audio: numpy.ndarray, blocksize: int
+) -> int:
+    """resample audio one block at a time, return the number of frames out"""
+    frames = 0
+    for start in range(0, len(audio), blocksize):
+        frames += len(resampler.resample_chunk(audio[start : start + blocksize]))
+    frames += len(resampler.resample_chunk(audio[:0], last=True))
+    return frames
+
+
+def time_tier(
+    audio: numpy.ndarray, in_rate: int, out_rate: int, quality: str, blocksize: int
+) -> float:
+    resampler = resample.stream(in_rate, out_rate, audio.shape[1], "float64", quality)
+    start = time.perf_counter()
+    stream_through(resampler, audio, blocksize)
+    return time.perf_counter() - start
+
+
+def time_setup(
+    in_rate: int, out_rate: int, channels: int, quality: str, repeats: int = 50
+) -> tuple[float, float]:
+    """(seconds to make a new stream, seconds to get a cleared one from the cache), each followed by its first small block
+    because soxr finishes setting up on the first block.
+    """
+    block = numpy.zeros((256, channels))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        soxr.ResampleStream(
+            in_rate, out_rate, channels, dtype="float64", quality=quality
+        ).resample_chunk(block)
+    new = (time.perf_counter() - start) / repeats
+
+    resample.stream(in_rate, out_rate, channels, "float64", quality)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        resample.stream(in_rate, out_rate, channels, "float64", quality).resample_chunk(
+            block
+        )
+    cached = (time.perf_counter() - start) / repeats
+
+    return new, cached
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--seconds", type=float, default=30, help="length of the test signal"
+    )
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument(
+        "--rates",
+        nargs="+",
+        default=["44100:48000", "48000:96000", "96000:192000"],
+        help="in:out samplerate pairs",
+    )
+    parser.add_argument("--blocksize", type=int, default=render.BLOCKSIZE)
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+
+    for pair in args.rates:
+        in_rate, out_rate = (int(rate) for rate in pair.split(":"))
+        audio = rng.uniform(-0.5, 0.5, (int(in_rate * args.seconds), args.channels))
+
+        print(f"{in_rate} -> {out_rate}, {args.seconds}s, {args.channels} channels")
+        print(
+            f"    {'quality':<8} {'time':>9} {'x realtime':>11} {'Mframes/s':>10} {'new stream':>11} {'cached':>9}"
+        )
+        for quality in RESAMPLE_QUALITIES:
+            seconds = time_tier(audio, in_rate, out_rate, quality, args.blocksize)
+            new, cached = time_setup(in_rate, out_rate, args.channels, quality)
+            print(
+                f"    {quality:<8} {seconds * 1000:7.1f}ms {args.seconds / seconds:10.1f}x "
+                f"{len(audio) / seconds / 1e6:10.2f} {new * 1000:9.2f}ms {cached * 1000:7.3f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
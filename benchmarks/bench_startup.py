@@ -0,0 +1,128 @@
+"""
+Time how long the GUI takes to start.
+Import times come from python -X importtime, time to first window from starting the app with SAUSAGE_STARTUP_PROBE set,
+which makes it close as soon as the window has been painted.
+
+python benchmarks/bench_startup.py
+python benchmarks/bench_startup.py --app dist/SausageFileConverter/SausageFileConverter --csv startup.csv
+
+--app runs the PyInstaller build from app-custom.spec instead of src/app.py.
+--csv adds a row per run so startup can be tracked between builds.
+"""
+
+from pathlib import Path
+import argparse
+import csv
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+def import_times(module: str = "mainwindow") -> list[tuple[str, int, int]]:
+    """[(module, self us, cumulative us), ...] for importing module in a new interpreter"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = []
+    for line in out.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return times
+
+
+def first_window(command: list[str]) -> tuple[float, float | None]:
+    """(wall seconds until the app exits, seconds the app measured itself or None if it has no console)"""
+    env = dict(os.environ, SAUSAGE_STARTUP_PROBE="1")
+
+    start = time.perf_counter()
+    out = subprocess.run(command, env=env, capture_output=True, text=True, timeout=120)
+    wall = time.perf_counter() - start
+
+    measured = None
+    for line in out.stdout.splitlines():
+        if line.startswith("first window:"):
+            measured = float(line.split(":")[1])
+
+    return wall, measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--app", nargs="+", help="command that starts the app. Default: src/app.py"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--top", type=int, default=15, help="number of slowest imports to show"
+    )
+    parser.add_argument("--csv", type=Path, help="add the results to this csv file")
+    args = parser.parse_args()
+
+    command = args.app or [sys.executable, str(SRC / "app.py")]
+
+    # the first run of each warms the disk cache
+    import_times()
+    first_window(command)
+
+    runs = [import_times() for _ in range(args.runs)]
+    total_import = statistics.median(
+        next(cumulative for name, _, cumulative in times if name == "mainwindow")
+        for times in runs
+    )
+
+    print(f"import mainwindow: {total_import / 1000:8.1f}ms (median of {args.runs})")
+    for name, self_us, cumulative_us in sorted(
+        runs[-1], key=lambda t: t[2], reverse=True
+    )[1 : args.top + 1]:
+        print(f"    {name:<40} {cumulative_us / 1000:8.1f}ms")
+
+    windows = [first_window(command) for _ in range(args.runs)]
+    wall = statistics.median(w for w, _ in windows)
+    measured = [m for _, m in windows if m is not None]
+    measured = statistics.median(measured) if measured else None
+
+    print(f"time to first window: {wall * 1000:8.1f}ms (median of {args.runs})")
+    if measured is not None:
+        print(f"    from app.py's first line: {measured * 1000:8.1f}ms")
+
+    if args.csv:
+        new_file = not args.csv.exists()
+        with open(args.csv, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(
+                    [
+                        "date",
+                        "command",
+                        "import_mainwindow_ms",
+                        "first_window_ms",
+                        "first_window_in_app_ms",
+                    ]
+                )
+            writer.writerow(
+                [
+                    datetime.datetime.now().isoformat(timespec="seconds"),
+                    " ".join(command),
+                    round(total_import / 1000, 1),
+                    round(wall * 1000, 1),
+                    "" if measured is None else round(measured * 1000, 1),
+                ]
+            )
+
+
+if __name__ == "__main__":
+    main()
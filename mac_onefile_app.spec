@@ -23,6 +23,19 @@ a = Analysis(
     "requests",
     "uuid",
     "worker",
+    "render",
+    "scan_cache",
+    "copier",
+    "probe",
+    "manifest",
+    "journal",
+    "pipeline",
+    "records",
+    "resample",
+    "channel_layouts",
+    "loudness",
+    "sqlite3",
+    "multiprocessing",
     "utils",
     "datetime",
     "os",
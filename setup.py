@@ -7,6 +7,17 @@ modules = [
     "src/worker.py",
     "src/telem.py",
     "src/file_tree.py",
+    "src/render.py",
+    "src/scan_cache.py",
+    "src/copier.py",
+    "src/probe.py",
+    "src/manifest.py",
+    "src/journal.py",
+    "src/pipeline.py",
+    "src/records.py",
+    "src/resample.py",
+    "src/channel_layouts.py",
+    "src/loudness.py",
 ]
 
 setup(ext_modules=cythonize(modules))
@@ -1,15 +1,36 @@
+import time
+
+# as early as possible, for the startup probe
+start_time = time.perf_counter()
+
 import multiprocessing
-from PySide6 import QtWidgets
 import sys
+import os
+
+# benchmarks/bench_startup.py sets this to time how long the window takes to appear, the app closes as soon as it is painted.
+STARTUP_PROBE = "SAUSAGE_STARTUP_PROBE"
+
+
+def report_startup(w):
+    print(f"first window: {time.perf_counter() - start_time:.4f}", flush=True)
+    w.close()
 
-from mainwindow import MainWindow
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
 
+    # render processes are spawned and import this module as __mp_main__, so Qt and the window are only imported here,
+    # where the frozen build's render processes don't get to either.
+    from PySide6 import QtWidgets
+    from mainwindow import MainWindow
+
+    startup_probe = bool(os.environ.get(STARTUP_PROBE))
+
     app = QtWidgets.QApplication(sys.argv)
 
-    w = MainWindow()
+    w = MainWindow(telemetry=not startup_probe)
+    if startup_probe:
+        w.window_painted.connect(lambda: report_startup(w))
     w.show()
     w.raise_()
 
@@ -0,0 +1,117 @@
+import math
+
+import numpy
+
+import exceptions
+from records import CHANNEL_LAYOUTS
+
+"""
+Qt free channel layouts and mixing matrices. A variation is mixed to the output's channel count with one matrix,
+applied to each block as it is streamed.
+"""
+
+
+# speakers of each layout in wav channel order, keyed by channel count like records.CHANNEL_LAYOUTS.
+# M is the single channel of a mono file, it isn't a centre speaker so mono to stereo copies it to both sides.
+SPEAKERS = {
+    1: ("M",),
+    2: ("L", "R"),
+    4: ("L", "R", "Ls", "Rs"),
+    6: ("L", "R", "C", "LFE", "Ls", "Rs"),
+    8: ("L", "R", "C", "LFE", "Lb", "Rb", "Ls", "Rs"),
+}
+assert SPEAKERS.keys() == CHANNEL_LAYOUTS.keys()
+
+MINUS_3DB = 1 / math.sqrt(2)
+
+# where a speaker goes when the output doesn't have it. Each speaker has alternatives of (speaker, gain) pairs,
+# the first alternative that the output has every speaker of is used, if there isn't one the last is folded again.
+# The downmix gains are the ITU-R BS.775 ones, the LFE is left out of downmixes.
+FOLDS = {
+    "M": ((("C", 1.0),), (("L", 1.0), ("R", 1.0))),
+    "C": ((("M", 1.0),), (("L", MINUS_3DB), ("R", MINUS_3DB))),
+    "L": ((("M", 0.5),),),
+    "R": ((("M", 0.5),),),
+    "Ls": ((("Lb", 1.0),), (("L", MINUS_3DB),)),
+    "Rs": ((("Rb", 1.0),), (("R", MINUS_3DB),)),
+    "Lb": ((("Ls", 1.0),), (("L", MINUS_3DB),)),
+    "Rb": ((("Rs", 1.0),), (("R", MINUS_3DB),)),
+    "LFE": (),
+}
+
+
+def _fold(speaker: str, gain: float, out_speakers: tuple) -> list[tuple[str, float]]:
+    """[(output speaker, gain), ...] that speaker is mixed into"""
+    if speaker in out_speakers:
+        return [(speaker, gain)]
+
+    alternatives = FOLDS[speaker]
+    if not alternatives:
+        return []
+
+    for alternative in alternatives:
+        if all(target in out_speakers for target, _ in alternative):
+            return [(target, gain * g) for target, g in alternative]
+
+    folded = []
+    for target, g in alternatives[-1]:
+        folded.extend(_fold(target, gain * g, out_speakers))
+    return folded
+
+
+def layout_matrix(in_channels: int, out_channels: int) -> numpy.ndarray:
+    """(out_channels, in_channels) matrix that mixes one of the CHANNEL_LAYOUTS to another.
+    raises ChannelCountError if either channel count isn't a known layout.
+    """
+    if in_channels not in SPEAKERS or out_channels not in SPEAKERS:
+        raise exceptions.ChannelCountError(
+            f"Error: No channel mapping from {in_channels} to {out_channels} channels"
+        )
+
+    in_speakers = SPEAKERS[in_channels]
+    out_speakers = SPEAKERS[out_channels]
+
+    matrix = numpy.zeros((out_channels, in_channels))
+    for column, speaker in enumerate(in_speakers):
+        for target, gain in _fold(speaker, 1.0, out_speakers):
+            matrix[out_speakers.index(target), column] += gain
+
+    return matrix
+
+
+def mix_matrix(
+    in_channels: int, out_channels: int, custom_matrix: list[list[float]] = None
+) -> numpy.ndarray | None:
+    """(out_channels, in_channels) matrix to mix a variation with, None if it is already in the output's channel count.
+    A custom matrix is used for variations with as many channels as it has columns.
+    """
+    if custom_matrix is not None and len(custom_matrix[0]) == in_channels:
+        if len(custom_matrix) != out_channels:
+            raise exceptions.ChannelCountError(
+                f"Error: Channel matrix has {len(custom_matrix)} rows, the output has {out_channels} channels"
+            )
+        return numpy.array(custom_matrix, dtype="float64")
+
+    if in_channels == out_channels:
+        return None
+
+    return layout_matrix(in_channels, out_channels)
+
+
+class ChannelMixer:
+    """Mixes float64 blocks with a matrix into a buffer that is reused for every block"""
+
+    def __init__(self, matrix: numpy.ndarray) -> None:
+        # blocks are (frames, channels), so they are multiplied by the transpose
+        self.matrix = numpy.ascontiguousarray(matrix.T)
+        self.buffer = numpy.empty((0, matrix.shape[0]))
+
+    def mix(self, block: numpy.ndarray) -> numpy.ndarray:
+        """the mixed block, a view of the buffer that is overwritten by the next call"""
+        # resampled blocks can be longer than the block size
+        if len(block) > len(self.buffer):
+            self.buffer = numpy.empty((len(block), self.matrix.shape[1]))
+
+        out = self.buffer[: len(block)]
+        numpy.matmul(block, self.matrix, out=out)
+        return out
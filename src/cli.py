@@ -0,0 +1,316 @@
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+
+import utils
+from pipeline import Pipeline
+from records import (
+    RESAMPLE_QUALITIES,
+    DEFAULT_RESAMPLE_QUALITY,
+    TARGET_SUBTYPES,
+    CHANNEL_LAYOUTS,
+)
+from scan_cache import ScanCache, default_cache_path
+
+"""
+Headless entry point, runs the same conversion as the GUI without importing Qt.
+
+python src/cli.py <input folder> [-o <output folder>] [--copy] [--jobs 8] [--json]
+"""
+
+
+EXIT_OK = 0
+# the conversion finished but some groups or copies failed, they are in the report
+EXIT_ERRORS = 1
+# bad arguments, argparse exits with 2 as well
+EXIT_USAGE = 2
+# cancelled with ctrl+c, the report is still written
+EXIT_CANCELLED = 130
+
+
+def non_negative_float(text: str) -> float:
+    value = float(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"{text} is below 0")
+    return value
+
+
+def positive_int(text: str) -> int:
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"{text} is below 1")
+    return value
+
+
+def channel_matrix(text: str) -> list[list[float]]:
+    try:
+        return utils.parse_channel_matrix(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"not a channel matrix: {e}")
+
+
+def lufs(text: str) -> float:
+    try:
+        value = utils.parse_normalise_lufs(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    if value is None:
+        raise argparse.ArgumentTypeError("no loudness given")
+    return value
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Append variations of sounds into single files, without the GUI."
+    )
+    parser.add_argument("input", type=Path, help="folder to convert")
+    parser.add_argument(
+        "-o", "--output", type=Path, help="Default: <input file path>_sausage"
+    )
+    parser.add_argument(
+        "--silence",
+        type=non_negative_float,
+        default=0.5,
+        help="seconds of silence between variations",
+    )
+    parser.add_argument(
+        "--max-duration",
+        type=non_negative_float,
+        default=0,
+        help="leave out variations this long or longer, in seconds. 0 is infinite",
+    )
+    parser.add_argument("--tag", default="", help="e.g. <file name>_sausage")
+    parser.add_argument("--exclude", default="", help="keywords separated with commas")
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="copy unprocessed files to output folder",
+    )
+    parser.add_argument(
+        "--resample-quality",
+        choices=RESAMPLE_QUALITIES,
+        default=DEFAULT_RESAMPLE_QUALITY,
+        help="soxr quality for variations that are resampled, from quick to very high. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--samplerate",
+        type=positive_int,
+        default=0,
+        help="convert every output to this samplerate. Default: the highest of each group",
+    )
+    parser.add_argument(
+        "--subtype",
+        choices=TARGET_SUBTYPES,
+        default="",
+        help="convert every output to this bit depth, groups with mixed bit depths need one. Default: the group's",
+    )
+    parser.add_argument(
+        "--channels",
+        type=int,
+        choices=CHANNEL_LAYOUTS,
+        default=0,
+        help="mix every output to this many channels, "
+        + ", ".join(f"{c} {name}" for c, name in CHANNEL_LAYOUTS.items())
+        + ". Default: the most of each group",
+    )
+    parser.add_argument(
+        "--channel-matrix",
+        type=channel_matrix,
+        help="gains to mix variations with as many channels as it has columns, one row per output channel. "
+        'e.g. "1,0,0.7;0,1,0.7" mixes three channels to two. Sets the output channel count',
+    )
+    parser.add_argument(
+        "--dither",
+        action="store_true",
+        help="TPDF dither variations that are written at a lower bit depth",
+    )
+    parser.add_argument(
+        "--loudness",
+        dest="measure_loudness",
+        action="store_true",
+        help="measure the peak, RMS and loudness of each output and variation, written next to the report as json",
+    )
+    parser.add_argument(
+        "--normalise",
+        type=lufs,
+        metavar="LUFS",
+        help="bring each variation to this integrated loudness before it is appended, as far as its peak allows",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="resume an interrupted conversion"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=None,
+        help="number of render processes. Default: one per core",
+    )
+    parser.add_argument(
+        "--report-dir", type=Path, help="Default: the GUI's report folder"
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="write progress to stdout as json lines, anything else goes to stderr",
+    )
+
+    args = parser.parse_args(argv)
+
+    if not args.input.is_dir():
+        parser.error(f"input folder does not exist: {args.input}")
+
+    if (
+        args.channel_matrix is not None
+        and args.channels
+        and args.channels != len(args.channel_matrix)
+    ):
+        parser.error(
+            f"--channel-matrix has {len(args.channel_matrix)} rows, --channels is {args.channels}"
+        )
+
+    return args
+
+
+class ProgressOutput:
+    """Writes the pipeline's signals out as text or json lines and counts failures for the exit code"""
+
+    def __init__(self, out, json_lines: bool) -> None:
+        self.out = out
+        self.json_lines = json_lines
+        self.failures = 0
+
+    def write(self, event: dict) -> None:
+        if self.json_lines:
+            print(json.dumps(event), file=self.out, flush=True)
+
+    def number_of_files(self, total: int, text: str) -> None:
+        self.write({"event": "stage", "stage": text, "total": total})
+        if not self.json_lines:
+            print(f"{text} {total}", file=self.out, flush=True)
+
+    def progress(self, count: int) -> None:
+        self.write({"event": "progress", "count": count})
+
+    def logger(self, function: str, success: bool, in_path: str, out_path: str):
+        if not success:
+            self.failures += 1
+
+        self.write(
+            {
+                "event": "log",
+                "function": function,
+                "success": success,
+                "input": in_path,
+                "output": out_path,
+            }
+        )
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    out = sys.stdout
+    if args.json:
+        # keep stdout for json, everything else that is printed, including by the render processes, goes to stderr.
+        sys.stdout.flush()
+        out = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    ctrl = {"break": False}
+
+    def interrupt(signum, frame):
+        # the first ctrl+c cancels like the GUI's cancel button, the second stops straight away.
+        if ctrl["break"]:
+            raise KeyboardInterrupt
+        ctrl["break"] = True
+        print(
+            "Cancelling, finishing the current files. ctrl+c again to stop now.",
+            file=sys.stderr,
+        )
+
+    signal.signal(signal.SIGINT, interrupt)
+
+    pipeline = Pipeline(ctrl, max_workers=args.jobs)
+    if args.report_dir is not None:
+        args.report_dir.mkdir(parents=True, exist_ok=True)
+        pipeline.report_path = args.report_dir
+
+    output = ProgressOutput(out, args.json)
+    pipeline.number_of_files.connect(output.number_of_files)
+    pipeline.progress.connect(output.progress)
+    pipeline.logger.connect(output.logger)
+
+    scan_cache = ScanCache(default_cache_path())
+    try:
+        audio_files, non_audio_files = utils.get_files(args.input, cache=scan_cache)
+    finally:
+        scan_cache.close()
+    ctrl["files_scanned"] = len(audio_files)
+
+    view_filtered_list = utils.remove_files_with_exclude(
+        audio_files, utils.exclusion_str_to_list(args.exclude), args.input
+    )
+
+    # like the GUI, no output folder means <input folder>_sausage
+    output_folder = args.output if args.output is not None else args.input
+
+    pipeline.all_inputs(
+        str(args.input),
+        str(output_folder),
+        args.silence,
+        args.max_duration,
+        args.copy,
+        view_filtered_list,
+        args.tag,
+        audio_files,
+        non_audio_files,
+        args.resume,
+        args.resample_quality,
+        args.samplerate,
+        args.subtype,
+        args.channels,
+        args.dither,
+        args.measure_loudness,
+        args.normalise,
+        args.channel_matrix,
+    )
+
+    if ctrl["break"]:
+        exit_code = EXIT_CANCELLED
+    elif output.failures:
+        exit_code = EXIT_ERRORS
+    else:
+        exit_code = EXIT_OK
+
+    report = f"{pipeline.report.file_name}.md"
+    output.write(
+        {
+            "event": "finished",
+            "exit_code": exit_code,
+            "files_scanned": ctrl["files_scanned"],
+            "files_created": ctrl["files_created"],
+            "failures": output.failures,
+            "report": report,
+            "loudness_report": (
+                str(pipeline.loudness_report_path())
+                if pipeline.loudness_entries
+                else None
+            ),
+        }
+    )
+    if not args.json:
+        print(
+            f"Created {ctrl['files_created']} files, {output.failures} failed. Report: {report}",
+            file=out,
+        )
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,297 @@
+from pathlib import Path
+from dataclasses import dataclass
+from collections import deque
+import concurrent.futures
+import errno
+import os
+import queue
+import shutil
+import sys
+import threading
+
+import utils
+
+"""
+Qt free copy stage. The Worker queues the files and folders it has planned to copy and carries on rendering,
+the copies run on a pool of threads and their results are collected by the Worker when it is ready for them.
+"""
+
+
+# number of threads copying at once.
+COPY_WORKERS = 16
+# number of copies taken from the pending queue at once, waiting for their device or copying, the rest wait as paths.
+MAX_IN_FLIGHT = 64
+# number of copies writing to the same device at once, so one slow drive doesn't take every thread.
+# copies wait in a queue for their device, so threads are only busy with copies that are running.
+DEVICE_WORKERS = 4
+
+# buffer size of the last resort copy, large reads and writes keep the number of system calls down.
+COPY_BUFSIZE = 8 * 1024 * 1024
+# linux ioctl that makes the destination share the source's extents on btrfs and xfs, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# errors that mean a kernel copy isn't supported for this pair of files, rather than the copy going wrong.
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+    errno.ENOTSOCK,
+    errno.ETXTBSY,
+}
+
+
+@dataclass
+class CopyResult:
+    """Result of one copy job, returned from the copy threads to the Worker"""
+
+    source: Path
+    destination: Path | None = None
+    error: Exception | None = None
+    cancelled: bool = False
+
+
+def copy_file(src: Path, dst: Path) -> None:
+    """
+    copy one file's contents, permission bits and times like shutil.copy2, the copy_function for copytree.
+    On linux the kernel copies the file without it going through python: a reflink is tried first, it costs nothing
+    on btrfs and xfs, then copy_file_range, which does server side copies on network filesystems, then sendfile.
+    If none of those are supported it falls back to a buffered copy with large buffers.
+    Other platforms use shutil.copyfile, which already uses fcopyfile on macOS and CopyFile on windows.
+    """
+    if sys.platform != "linux":
+        shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+        return
+
+    # unbuffered, so every method reads and writes from the same file offsets and can carry on where another left off.
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb", buffering=0) as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+
+        if not (
+            _reflink(fsrc, fdst)
+            or _kernel_copy(os.copy_file_range, fsrc, fdst, size)
+            or _kernel_copy(os.sendfile, fsrc, fdst, size)
+        ):
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+
+    # after the files are closed, so the writes don't update the modified time again
+    shutil.copystat(src, dst)
+
+
+def _reflink(fsrc, fdst) -> bool:
+    """clone the whole file, True if it worked"""
+    import fcntl
+
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        # not a filesystem that supports it, or the files are on different filesystems.
+        return False
+
+    return True
+
+
+def _kernel_copy(copy_function, fsrc, fdst, size: int) -> bool:
+    """copy with os.copy_file_range or os.sendfile from the current offsets, True if the file was copied.
+    If it isn't supported before anything is copied return False, a failure part way through is raised.
+    """
+    copied = 0
+    while copied < size:
+        # the kernel copies at most about 2GB per call
+        count = min(size - copied, 2**30)
+        try:
+            if copy_function is os.sendfile:
+                sent = os.sendfile(fdst.fileno(), fsrc.fileno(), None, count)
+            else:
+                sent = copy_function(fsrc.fileno(), fdst.fileno(), count)
+        except OSError as e:
+            if copied == 0 and e.errno in UNSUPPORTED_ERRNOS:
+                return False
+            raise
+
+        if sent == 0:
+            # some filesystems report nothing copied instead of an error
+            if copied == 0:
+                return False
+            # the source got shorter since it was stat'd
+            break
+        copied += sent
+
+    return True
+
+
+def copy_path(file: Path, input_folder: Path, output_folder: Path) -> Path:
+    """copy a file or a whole folder to the same place in the output folder, return where it was copied to."""
+    out_path = utils.create_output_path(file, input_folder, output_folder)
+
+    # check if the file is a file or a folder
+    if file.is_file():
+        utils.create_parent_folders(out_path)
+        copy_file(file, out_path)
+    elif file.is_dir():
+        # folders are only planned when nothing inside them is converted, so copy into it if it already exists.
+        shutil.copytree(file, out_path, copy_function=copy_file, dirs_exist_ok=True)
+    else:
+        # removed since the scan
+        raise FileNotFoundError(f"No such file or directory: '{file}'")
+
+    return out_path
+
+
+def device_of(path: Path) -> int:
+    """st_dev of the device a path will be written to, the output path may not exist yet so use its nearest existing parent."""
+    for parent in (path, *path.parents):
+        try:
+            return os.stat(parent).st_dev
+        except OSError:
+            continue
+
+    return 0
+
+
+class CopyEngine:
+    """
+    Copy files and folders on a pool of threads.
+    Jobs can be submitted at any time until close() is called, including while results are being collected,
+    so variations that fail to render can be copied after the planned copies have started.
+    Jobs are queued by the device they are written to and handed to the pool device_workers at a time per device,
+    so writing everything to one drive uses device_workers threads instead of every thread waiting on it.
+    """
+
+    def __init__(
+        self,
+        input_folder: Path,
+        output_folder: Path,
+        max_workers: int = COPY_WORKERS,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        device_workers: int = DEVICE_WORKERS,
+    ) -> None:
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.device_workers = device_workers
+
+        self.submitted = 0
+        self.collected = 0
+
+        self.pending = queue.SimpleQueue()
+        self.results = queue.SimpleQueue()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.cancelled = threading.Event()
+
+        # jobs waiting for their device, number of jobs copying to each device, and the device of each output folder
+        self.device_queues = {}
+        self.device_active = {}
+        self.devices = {}
+        # jobs taken from the pending queue that haven't finished, and if the pending queue has been closed
+        self.queued = 0
+        self.feeding_done = False
+        self.lock = threading.Lock()
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="copy"
+        )
+        # the feeder hands pending jobs to the pool as in flight slots free up.
+        self.feeder = threading.Thread(target=self._feed, daemon=True)
+        self.feeder.start()
+
+    def submit(self, file: Path) -> None:
+        """queue a file or folder to be copied, never blocks."""
+        self.submitted += 1
+        self.pending.put(file)
+
+    def close(self) -> None:
+        """no more jobs will be submitted, the pool shuts down once the queued ones are done."""
+        self.pending.put(None)
+
+    def cancel(self) -> None:
+        """skip the jobs that haven't started yet, the ones already copying are finished."""
+        self.cancelled.set()
+
+    def outstanding(self) -> int:
+        """number of submitted jobs whose result hasn't been collected yet"""
+        return self.submitted - self.collected
+
+    def collect(self, block: bool = False):
+        """yield the results of finished jobs. If block is True wait until every submitted job has a result."""
+        while self.outstanding() > 0:
+            try:
+                result = self.results.get(block=block)
+            except queue.Empty:
+                return
+
+            self.collected += 1
+            yield result
+
+    def _feed(self) -> None:
+        while True:
+            file = self.pending.get()
+            if file is None:
+                break
+
+            if self.cancelled.is_set():
+                self.results.put(CopyResult(source=file, cancelled=True))
+                continue
+
+            # wait for a free slot, this is what keeps the device queues bounded.
+            self.in_flight.acquire()
+            try:
+                device = self._device(file)
+            except Exception:
+                # the copy raises the same error and reports it
+                device = 0
+            with self.lock:
+                self.queued += 1
+                self.device_queues.setdefault(device, deque()).append(file)
+                self._dispatch(device)
+
+        with self.lock:
+            self.feeding_done = True
+            self._shutdown_if_done()
+
+    def _device(self, file: Path) -> int:
+        """device the file is copied to, looked up once per output folder"""
+        parent = utils.create_output_path(
+            file, self.input_folder, self.output_folder
+        ).parent
+        device = self.devices.get(parent)
+        if device is None:
+            device = self.devices[parent] = device_of(parent)
+
+        return device
+
+    def _dispatch(self, device: int) -> None:
+        """hand queued jobs for a device to the pool while it has fewer than device_workers copying, called with the lock held."""
+        waiting = self.device_queues[device]
+        while waiting and self.device_active.get(device, 0) < self.device_workers:
+            self.device_active[device] = self.device_active.get(device, 0) + 1
+            self.executor.submit(self._copy, waiting.popleft(), device)
+
+    def _shutdown_if_done(self) -> None:
+        # called with the lock held, the pool shuts down once nothing more can be submitted and every job has finished.
+        if self.feeding_done and self.queued == 0:
+            self.executor.shutdown(wait=False)
+
+    def _copy(self, file: Path, device: int) -> None:
+        result = CopyResult(source=file)
+        try:
+            if self.cancelled.is_set():
+                result.cancelled = True
+            else:
+                result.destination = copy_path(
+                    file, self.input_folder, self.output_folder
+                )
+
+        except Exception as e:
+            result.error = e
+
+        finally:
+            with self.lock:
+                self.queued -= 1
+                self.device_active[device] -= 1
+                self._dispatch(device)
+                self._shutdown_if_done()
+
+            self.in_flight.release()
+            self.results.put(result)
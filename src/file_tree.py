@@ -1,7 +1,12 @@
 from pathlib import Path
+import bisect
+import natsort
 from PySide6 import QtCore
 from PySide6.QtCore import Qt
 
+# sort key for paths so rows are inserted in the same order as a natsorted list of files
+natsort_key = natsort.natsort_keygen()
+
 
 class TreeItem:
     def __init__(self, data, parent=None):
@@ -38,6 +43,7 @@ class TreeModel(QtCore.QAbstractItemModel):
         super(TreeModel, self).__init__(parent)
 
         self.rootItem = TreeItem(parent)
+        self.parent_dict = {}
         self.setupModelData(data, root_parent_path, self.rootItem)
 
     def columnCount(self, parent):
@@ -119,6 +125,8 @@ class TreeModel(QtCore.QAbstractItemModel):
     ):
 
         parent_dict = {root_parent_path: root_parent_item}
+        # kept so that insertFiles can add to the tree later
+        self.parent_dict = parent_dict
 
         def has_parent_in_list(
             file_path: Path,
@@ -184,6 +192,41 @@ class TreeModel(QtCore.QAbstractItemModel):
 
         # return parent_dict
 
+    def itemIndex(self, item: TreeItem) -> QtCore.QModelIndex:
+        if item == self.rootItem:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(item.row(), 0, item)
+
+    def insertFiles(self, list_of_files: list):
+        """Add files to a model that is already being shown, missing parent folders are created.
+        Rows are inserted in natsort order with beginInsertRows/endInsertRows so the view updates as they arrive.
+        """
+        for file in list_of_files:
+            self._insertPath(file)
+
+    def _insertPath(self, path: Path) -> TreeItem:
+        if path in self.parent_dict:
+            return self.parent_dict[path]
+
+        # make sure the parent folder is in the tree first, going up until a folder that is.
+        parent_item = self._insertPath(path.parent)
+
+        # find the row that keeps the children in natsort order
+        row = bisect.bisect(
+            parent_item.childItems,
+            natsort_key(path),
+            key=lambda item: natsort_key(item.data()),
+        )
+
+        self.beginInsertRows(self.itemIndex(parent_item), row, row)
+        item = TreeItem(path, parent_item)
+        parent_item.childItems.insert(row, item)
+        self.parent_dict[path] = item
+        self.endInsertRows()
+
+        return item
+
 
 class FilterProxyModel(QtCore.QSortFilterProxyModel):
     def __init__(self, parent=None):
@@ -0,0 +1,132 @@
+from pathlib import Path
+import json
+import os
+import time
+
+"""
+Qt free job journal. Every variation group is written to it as pending when it is queued and as done or failed when its result comes in,
+so the work finished before a crash or cancel can be picked up by a resumed run.
+"""
+
+
+JOURNAL_NAME = ".sausage_journal.jsonl"
+# done and failed lines are synced to disk after this many lines or seconds, whichever comes first
+SYNC_LINES = 32
+SYNC_SECONDS = 2.0
+
+
+class Journal:
+    """
+    Append only json lines in the output folder, one line per change of state:
+    {"state": "pending", "output": key, "sources": [path, ...]}
+    {"state": "done", "output": key, "entry": manifest entry}
+    {"state": "failed", "output": key, "error": str}
+    Pending lines are written together and synced once, by sync(), when every group has been queued.
+    Done and failed lines are flushed as they are written and synced every SYNC_LINES lines or SYNC_SECONDS,
+    a group whose line didn't reach the disk before a power cut is rendered again. A line cut short by a crash is ignored when it is read.
+    """
+
+    def __init__(self, output_folder: Path) -> None:
+        self.output_folder = Path(output_folder)
+        self.path = self.output_folder / JOURNAL_NAME
+        self.file = None
+        # lines written since the last sync and when that was
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def read(self) -> list[dict]:
+        """every complete line of the journal in the order they were written"""
+        entries = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # cut short by a crash
+                        continue
+        except OSError:
+            pass
+
+        return entries
+
+    def done_entries(self) -> dict:
+        """{output key: manifest entry} of every group the journal has recorded as done and not queued again since."""
+        done = {}
+        for entry in self.read():
+            if entry.get("state") == "done":
+                done[entry["output"]] = entry["entry"]
+            else:
+                done.pop(entry.get("output"), None)
+
+        return done
+
+    def unfinished(self) -> list[str]:
+        """output keys of the groups that were queued and never finished, a run that was killed may have left them half written."""
+        states = {}
+        for entry in self.read():
+            states[entry.get("output")] = entry.get("state")
+
+        return [key for key, state in states.items() if state == "pending"]
+
+    def open(self, resume: bool = False) -> None:
+        """start writing, a resumed journal is added to, otherwise it starts empty."""
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+        # start on a new line after a line that was cut short
+        if self.file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, 2)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def remove(self) -> None:
+        """the run finished, everything in the journal is in the manifest now."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def pending(self, key: str, sources: list[Path]) -> None:
+        """queue a group, it isn't on disk until sync() is called once every group has been queued."""
+        self.file.write(
+            json.dumps(
+                {
+                    "state": "pending",
+                    "output": key,
+                    "sources": [str(s) for s in sources],
+                }
+            )
+            + "\n"
+        )
+        self.unsynced += 1
+
+    def done(self, key: str, entry: dict) -> None:
+        self._write({"state": "done", "output": key, "entry": entry})
+
+    def failed(self, key: str, error) -> None:
+        self._write({"state": "failed", "output": key, "error": str(error)})
+
+    def sync(self) -> None:
+        """flush everything written so far and sync it to disk"""
+        self.file.flush()
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def _write(self, entry: dict) -> None:
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+
+        if (
+            self.unsynced >= SYNC_LINES
+            or time.monotonic() - self.synced_at >= SYNC_SECONDS
+        ):
+            self.sync()
@@ -0,0 +1,271 @@
+import math
+
+import numpy
+
+from channel_layouts import SPEAKERS
+
+"""
+Qt free peak, RMS and EBU R128 loudness measurement of blocks as they are rendered.
+Loudness follows ITU-R BS.1770-4: K-weighting, 400ms blocks every 100ms, an absolute gate at -70 LUFS and a relative gate 10 LU below.
+
+numpy has no recursive filter, so the two K-weighting biquads are applied as their impulse response,
+100ms long which is well past where it has died away, by FFT convolution one block at a time.
+"""
+
+
+# length of the gating blocks and the step between them, in seconds
+BLOCK_SECONDS = 0.4
+STEP_SECONDS = 0.1
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# channel weights, surround channels are 1.41 (+1.5dB) and the LFE isn't measured
+SURROUND_WEIGHT = 1.41
+SPEAKER_WEIGHTS = {
+    "Ls": SURROUND_WEIGHT,
+    "Rs": SURROUND_WEIGHT,
+    "Lb": SURROUND_WEIGHT,
+    "Rb": SURROUND_WEIGHT,
+    "LFE": 0.0,
+}
+
+
+def channel_weights(channels: int) -> numpy.ndarray:
+    """BS.1770 weight of each channel, channel counts without a known layout are weighted equally"""
+    speakers = SPEAKERS.get(channels)
+    if speakers is None:
+        return numpy.ones(channels)
+
+    return numpy.array([SPEAKER_WEIGHTS.get(speaker, 1.0) for speaker in speakers])
+
+
+def k_weighting_coefficients(samplerate: int) -> list[tuple[list, list]]:
+    """(b, a) of the high shelf and high pass biquads of the K-weighting at samplerate, as libebur128 works them out"""
+    # high shelf, the acoustic effect of the head
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / samplerate)
+    vh = 10 ** (gain / 20)
+    vb = vh**0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (
+        [
+            (vh + vb * k / q + k * k) / a0,
+            2 * (k * k - vh) / a0,
+            (vh - vb * k / q + k * k) / a0,
+        ],
+        [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0],
+    )
+
+    # high pass, RLB weighting
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / samplerate)
+    a0 = 1 + k / q + k * k
+    high_pass = (
+        [1.0, -2.0, 1.0],
+        [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0],
+    )
+
+    return [shelf, high_pass]
+
+
+def k_weighting_impulse_response(samplerate: int) -> numpy.ndarray:
+    """the first 100ms of the K-weighting's impulse response, from its frequency response"""
+    taps = int(samplerate * STEP_SECONDS)
+    # sampled finely enough that the response folding back from past the end is far below the noise floor
+    size = 1 << (4 * taps - 1).bit_length()
+
+    z = numpy.exp(-1j * numpy.linspace(0, numpy.pi, size // 2 + 1))
+    response = numpy.ones_like(z)
+    for b, a in k_weighting_coefficients(samplerate):
+        response *= numpy.polyval(b[::-1], z) / numpy.polyval(a[::-1], z)
+
+    return numpy.fft.irfft(response, size)[:taps]
+
+
+class KWeighting:
+    """K-weights a stream of (frames, channels) float blocks, the filter carries on from one block to the next"""
+
+    def __init__(self, samplerate: int, channels: int) -> None:
+        self.taps = k_weighting_impulse_response(samplerate)
+        # the part of the filtered signal that is still to come from the blocks so far
+        self.tail = numpy.zeros((len(self.taps) - 1, channels))
+        # fft of the impulse response, keyed by fft size
+        self.spectra = {}
+
+    def filter(self, block: numpy.ndarray) -> numpy.ndarray:
+        frames = len(block)
+        length = frames + len(self.tail)
+        size = 1 << (length - 1).bit_length()
+
+        spectrum = self.spectra.get(size)
+        if spectrum is None:
+            spectrum = numpy.fft.rfft(self.taps, size)[:, None]
+            self.spectra[size] = spectrum
+
+        filtered = numpy.fft.irfft(
+            numpy.fft.rfft(block, size, axis=0) * spectrum, size, axis=0
+        )[:length]
+        filtered[: len(self.tail)] += self.tail
+        self.tail = filtered[frames:].copy()
+
+        return filtered[:frames]
+
+    def silence(self, frames: int) -> numpy.ndarray:
+        """K-weighted frames of silence, only the tail of the blocks before it isn't zeros and only that is returned"""
+        ringing = min(frames, len(self.tail))
+        filtered = self.tail[:ringing].copy()
+        self.tail = numpy.concatenate(
+            (self.tail[ringing:], numpy.zeros((ringing, self.tail.shape[1])))
+        )
+
+        return filtered
+
+
+class Measurement:
+    """peak, RMS and gated loudness of the blocks added to it"""
+
+    def __init__(self, samplerate: int, channels: int) -> None:
+        self.channels = channels
+        self.step_frames = round(samplerate * STEP_SECONDS)
+        self.steps_per_block = round(BLOCK_SECONDS / STEP_SECONDS)
+        self.peak = 0.0
+        self.sum_of_squares = 0.0
+        self.frames = 0
+        # weighted sum of the K-weighted squares of each 100ms step
+        self.steps = []
+        self.partial_step = 0.0
+        self.partial_frames = 0
+
+    def add(self, block: numpy.ndarray, power: numpy.ndarray) -> None:
+        """block is the samples, power the weighted sum of their K-weighted squares for each frame"""
+        if len(block):
+            self.peak = max(self.peak, float(block.max()), -float(block.min()))
+            self.sum_of_squares += float(numpy.einsum("ij,ij->", block, block))
+        self.frames += len(block)
+        self._add_power(power)
+
+    def add_silence(self, frames: int, power: numpy.ndarray) -> None:
+        """frames of silence, power is the filter's ringing at their start"""
+        self.frames += frames
+        self._add_power(power)
+        self._add_zeros(frames - len(power))
+
+    def _add_power(self, power: numpy.ndarray) -> None:
+        # fill the step that was started by the last block
+        start = min(len(power), self.step_frames - self.partial_frames)
+        self.partial_step += float(power[:start].sum())
+        self.partial_frames += start
+        if self.partial_frames < self.step_frames:
+            return
+        self.steps.append(self.partial_step)
+
+        whole_steps = (len(power) - start) // self.step_frames
+        end = start + whole_steps * self.step_frames
+        self.steps.extend(
+            power[start:end].reshape(whole_steps, self.step_frames).sum(axis=1).tolist()
+        )
+
+        self.partial_step = float(power[end:].sum())
+        self.partial_frames = len(power) - end
+
+    def _add_zeros(self, frames: int) -> None:
+        start = min(frames, self.step_frames - self.partial_frames)
+        self.partial_frames += start
+        if self.partial_frames < self.step_frames:
+            return
+        self.steps.append(self.partial_step)
+
+        whole_steps = (frames - start) // self.step_frames
+        self.steps.extend([0.0] * whole_steps)
+
+        self.partial_step = 0.0
+        self.partial_frames = frames - start - whole_steps * self.step_frames
+
+    def integrated_loudness(self) -> float | None:
+        """gated loudness in LUFS, None if there isn't a block above the absolute gate, i.e shorter than 400ms or silent"""
+        steps = numpy.array(self.steps)
+        if len(steps) < self.steps_per_block:
+            return None
+
+        # mean square of each 400ms block, they overlap by 75%
+        blocks = numpy.lib.stride_tricks.sliding_window_view(
+            steps, self.steps_per_block
+        ).sum(axis=1)
+        blocks /= self.steps_per_block * self.step_frames
+
+        with numpy.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * numpy.log10(blocks)
+
+        gated = loudness > ABSOLUTE_GATE
+        if not gated.any():
+            return None
+
+        relative_gate = -0.691 + 10 * math.log10(blocks[gated].mean()) + RELATIVE_GATE
+        gated &= loudness > relative_gate
+
+        return -0.691 + 10 * math.log10(blocks[gated].mean())
+
+    def result(self) -> dict:
+        """{"peak_dbfs", "rms_dbfs", "integrated_lufs"}, None for silence"""
+        rms = None
+        if self.sum_of_squares > 0:
+            rms = 10 * math.log10(self.sum_of_squares / (self.frames * self.channels))
+
+        return {
+            "peak_dbfs": 20 * math.log10(self.peak) if self.peak > 0 else None,
+            "rms_dbfs": rms,
+            "integrated_lufs": self.integrated_loudness(),
+        }
+
+
+class Analyser:
+    """Measures an output as it is written, and each variation in it. Blocks are K-weighted once for both."""
+
+    def __init__(self, samplerate: int, channels: int) -> None:
+        self.samplerate = samplerate
+        self.channels = channels
+        self.weights = channel_weights(channels)
+        self.k_weighting = KWeighting(samplerate, channels)
+        self.output = Measurement(samplerate, channels)
+        self.variation = None
+
+    def start_variation(self) -> None:
+        self.variation = Measurement(self.samplerate, self.channels)
+
+    def end_variation(self) -> dict:
+        result = self.variation.result()
+        self.variation = None
+        return result
+
+    def add(self, block: numpy.ndarray) -> None:
+        # integer samples, read without converting them because the output doesn't need it, are scaled to -1.0 to 1.0
+        if block.dtype.kind == "i":
+            block = block * (1.0 / -numpy.iinfo(block.dtype).min)
+
+        filtered = self.k_weighting.filter(block)
+        numpy.square(filtered, out=filtered)
+        power = filtered @ self.weights
+
+        self.output.add(block, power)
+        if self.variation is not None:
+            self.variation.add(block, power)
+
+    def add_silence(self, frames: int) -> None:
+        ringing = self.k_weighting.silence(frames)
+        power = numpy.square(ringing) @ self.weights
+
+        self.output.add_silence(frames, power)
+        if self.variation is not None:
+            self.variation.add_silence(frames, power)
+
+
+def measure(blocks, samplerate: int, channels: int) -> dict:
+    """measure float blocks of one file, see Measurement.result"""
+    analyser = Analyser(samplerate, channels)
+    for block in blocks:
+        analyser.add(block)
+
+    return analyser.output.result()
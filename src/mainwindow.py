@@ -2,8 +2,15 @@ from PySide6 import QtWidgets, QtCore, QtGui
 from pathlib import Path
 
 from worker import Worker, ViewWorker
+import utils
 from telem import Telem
 from file_tree import TreeModel, FilterProxyModel
+from records import (
+    RESAMPLE_QUALITIES,
+    DEFAULT_RESAMPLE_QUALITY,
+    TARGET_SUBTYPES,
+    CHANNEL_LAYOUTS,
+)
 
 import sys
 
@@ -12,9 +19,13 @@ DOCS_URL = "https://drive.google.com/drive/folders/1xd2OL913scQhadmyo6mU79cbZ2ik
 
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, parent=None):
+    # sent once, after the window has been painted for the first time
+    window_painted = QtCore.Signal()
+
+    def __init__(self, parent=None, telemetry=True):
         super(MainWindow, self).__init__(parent)
         self.setWindowTitle("SausageFileConverter")
+        self._painted = False
 
         # Menu bars are complicated on Mac, just don't use them for now
         if sys.platform != "darwin":
@@ -22,6 +33,18 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.create_main_frame()
 
+        # telemetry starts once the window is on screen, so its first request never slows down startup.
+        if telemetry:
+            self.window_painted.connect(self.mainWidget.telem.start)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+        if not self._painted:
+            self._painted = True
+            # queued, so the first paint finishes before anything connected to it runs
+            QtCore.QTimer.singleShot(0, self.window_painted.emit)
+
     def create_menus(self):
         self.aboutAction = QtGui.QAction("About", self, triggered=self.on_about)
         # self.websiteAction = QtGui.QAction("Website", self, triggered=self.on_website)
@@ -69,11 +92,33 @@ class MainWindow(QtWidgets.QMainWindow):
 
 class MainWidget(QtWidgets.QWidget):
 
-    submit_signal = QtCore.Signal(str, str, float, float, bool, list, str, list, list)
-    # input folder, output folder, silence duration, maximum duration, copy files, view_filtered_list, append tag, audio_files, non_audio_files.
+    submit_signal = QtCore.Signal(
+        str,
+        str,
+        float,
+        float,
+        bool,
+        list,
+        str,
+        list,
+        list,
+        bool,
+        str,
+        int,
+        str,
+        int,
+        bool,
+        bool,
+        object,
+        object,
+    )
+    # input folder, output folder, silence duration, maximum duration, copy files, view_filtered_list, append tag, audio_files, non_audio_files, resume, resample quality,
+    # target samplerate, target subtype, target channels, dither. 0 or "" keeps the variations' format.
+    # measure loudness, loudness to normalise variations to, None leaves them as they are.
+    # channel matrix to mix variations with, None uses their channel layout's.
 
     # Send files and path to setup TreeModel
-    send_dir_to_process_files = QtCore.Signal(Path)
+    send_dir_to_process_files = QtCore.Signal(Path, int)
 
     # progress bar input slots and settings.
     @QtCore.Slot(int, str)
@@ -116,15 +161,29 @@ class MainWidget(QtWidgets.QWidget):
             self.logger.verticalScrollBar().maximum()
         )
 
-    @QtCore.Slot(list, list, list)
-    def receive_files_to_make_TreeModel(self, files_list, audio_files, non_audio_files):
-        """Get audio files and non-audio files from ViewWorker, create model from them and close loading message box"""
+    @QtCore.Slot(int, list)
+    def receive_batch_of_variations(self, generation, files_list):
+        """Add a folder's worth of variations from ViewWorker to the model as soon as they are found"""
+        # ignore batches from a previous scan, including one of the same folder selected again
+        if generation != self.scan_generation:
+            return
+
+        self.model.insertFiles(files_list)
+        # the first results are in, so let the user see them while the rest are found
+        self.loading.accept()
+
+    @QtCore.Slot(int, list, list)
+    def receive_audio_and_non_audio_files(
+        self, generation, audio_files, non_audio_files
+    ):
+        """Get audio files and non-audio files from ViewWorker when the scan has finished and close loading message box"""
+        if generation != self.scan_generation:
+            return
+
         self.audio_files = audio_files
         self.non_audio_files = non_audio_files
 
-        self.model = TreeModel(files_list, Path(self.inputfolder_input.text()))
-        self.proxy_model.setSourceModel(self.model)
-        self.tree_view.setModel(self.proxy_model)
+        self.convert_button.setEnabled(True)
         self.loading.accept()
 
     def __init__(self, *args, **kwargs) -> None:
@@ -133,6 +192,8 @@ class MainWidget(QtWidgets.QWidget):
         self.audio_files = None
         self.non_audio_files = None
         self.ctrl = {"break": False, "files_created": 0}
+        # number of the latest folder scan, results of earlier scans are ignored
+        self.scan_generation = 0
         self._is_processing = False
         self.model = TreeModel([], None)
         self.proxy_model = FilterProxyModel()
@@ -144,6 +205,10 @@ class MainWidget(QtWidgets.QWidget):
         self.exclusionfield_label = QtWidgets.QLabel("Filter files:")
         self.silenceduration_label = QtWidgets.QLabel("Silence between clips (seconds)")
         self.maxduration_label = QtWidgets.QLabel("Maximum file length to append")
+        self.resamplequality_label = QtWidgets.QLabel("Resampling quality")
+        self.outputformat_label = QtWidgets.QLabel("Output format")
+        self.normalise_label = QtWidgets.QLabel("Normalise variations to (LUFS)")
+        self.channelmatrix_label = QtWidgets.QLabel("Channel matrix")
 
         self.tree_view = QtWidgets.QTreeView()
         self.tree_view.setModel(self.proxy_model)
@@ -185,6 +250,25 @@ class MainWidget(QtWidgets.QWidget):
         self.appendtag_input = QtWidgets.QLineEdit()
         self.silenceduration_input = QtWidgets.QLineEdit()
         self.maxduration_input = QtWidgets.QLineEdit()
+        self.normalise_input = QtWidgets.QLineEdit()
+        self.channelmatrix_input = QtWidgets.QLineEdit()
+        # fastest first, quick is fine for previews, very high for the final library
+        self.resamplequality_input = QtWidgets.QComboBox()
+        self.resamplequality_input.addItems(RESAMPLE_QUALITIES)
+        self.resamplequality_input.setCurrentText(DEFAULT_RESAMPLE_QUALITY)
+        # the item data is what is sent to the worker, "Keep" leaves the group's own format
+        self.samplerate_input = QtWidgets.QComboBox()
+        self.samplerate_input.addItem("Keep sample rate", 0)
+        for samplerate in (44100, 48000, 88200, 96000, 192000):
+            self.samplerate_input.addItem(f"{samplerate} Hz", samplerate)
+        self.bitdepth_input = QtWidgets.QComboBox()
+        self.bitdepth_input.addItem("Keep bit depth", "")
+        for subtype, name in TARGET_SUBTYPES.items():
+            self.bitdepth_input.addItem(name, subtype)
+        self.channels_input = QtWidgets.QComboBox()
+        self.channels_input.addItem("Keep channels", 0)
+        for channels, name in CHANNEL_LAYOUTS.items():
+            self.channels_input.addItem(name, channels)
         self.inputfolder_button = QtWidgets.QPushButton("Browse")
         self.outputfolder_button = QtWidgets.QPushButton("Browse")
         self.convert_button = QtWidgets.QPushButton("Sausage!")
@@ -193,6 +277,13 @@ class MainWidget(QtWidgets.QWidget):
         self.copyfiles_checkbox = QtWidgets.QCheckBox(
             "Copy unprocessed files to output folder", self
         )
+        self.resume_checkbox = QtWidgets.QCheckBox(
+            "Resume an interrupted conversion", self
+        )
+        self.dither_checkbox = QtWidgets.QCheckBox(
+            "Dither when reducing bit depth", self
+        )
+        self.loudness_checkbox = QtWidgets.QCheckBox("Measure peak and loudness", self)
 
         # add widgets to layouts
         layout = QtWidgets.QVBoxLayout()  # vertical layout
@@ -223,6 +314,21 @@ class MainWidget(QtWidgets.QWidget):
         side_bar_layout.addWidget(self.appendtag_input, 0, 5)
         # checkboxes
         side_bar_layout.addWidget(self.copyfiles_checkbox, 3, 0, 1, 2)
+        side_bar_layout.addWidget(self.resume_checkbox, 3, 2, 1, 2)
+        side_bar_layout.addWidget(self.resamplequality_label, 3, 4)
+        side_bar_layout.addWidget(self.resamplequality_input, 3, 5)
+        # output format
+        side_bar_layout.addWidget(self.outputformat_label, 4, 0)
+        side_bar_layout.addWidget(self.samplerate_input, 4, 1)
+        side_bar_layout.addWidget(self.bitdepth_input, 4, 2)
+        side_bar_layout.addWidget(self.channels_input, 4, 3)
+        side_bar_layout.addWidget(self.dither_checkbox, 4, 4, 1, 2)
+        # loudness
+        side_bar_layout.addWidget(self.loudness_checkbox, 5, 0, 1, 2)
+        side_bar_layout.addWidget(self.normalise_label, 5, 2)
+        side_bar_layout.addWidget(self.normalise_input, 5, 3)
+        side_bar_layout.addWidget(self.channelmatrix_label, 5, 4)
+        side_bar_layout.addWidget(self.channelmatrix_input, 5, 5)
 
         layout.addLayout(input_options_layout)
         layout.addWidget(self.tree_view)
@@ -237,6 +343,12 @@ class MainWidget(QtWidgets.QWidget):
         # Set placeholder text
         self.silenceduration_input.setPlaceholderText("0.5")
         self.maxduration_input.setPlaceholderText("infinite")
+        self.normalise_input.setPlaceholderText("off, e.g. -23")
+        self.channelmatrix_input.setPlaceholderText("layout's, e.g. 1,0,0.7;0,1,0.7")
+        self.channelmatrix_input.setToolTip(
+            "One row per output channel separated with ;, one gain per input channel separated with ,\n"
+            "Variations with as many channels as it has columns are mixed with it"
+        )
         self.outputfolder_input.setPlaceholderText("Default: <input file path>_sausage")
         self.exclusionfield_input.setPlaceholderText(
             "Insert keywords separated with commas"
@@ -251,6 +363,12 @@ class MainWidget(QtWidgets.QWidget):
         self.silenceduration_input.setValidator(v)
         self.maxduration_input.setValidator(v)
 
+        lufs = QtGui.QDoubleValidator(
+            utils.MIN_NORMALISE_LUFS, utils.MAX_NORMALISE_LUFS, 1
+        )
+        lufs.setNotation(QtGui.QDoubleValidator.StandardNotation)
+        self.normalise_input.setValidator(lufs)
+
         # Create Worker/Worker thread for long running task
         self.worker = Worker(self.ctrl)
         self.worker_thread = QtCore.QThread()
@@ -282,8 +400,11 @@ class MainWidget(QtWidgets.QWidget):
         self.send_dir_to_process_files.connect(
             self.view_worker.get_files_and_find_variations
         )
-        self.view_worker.return_list_of_files_for_TreeModel.connect(
-            self.receive_files_to_make_TreeModel
+        self.view_worker.return_batch_of_variations.connect(
+            self.receive_batch_of_variations
+        )
+        self.view_worker.return_audio_and_non_audio_files.connect(
+            self.receive_audio_and_non_audio_files
         )
 
         self.show_reports_button.clicked.connect(self.worker.show_reports_folder)
@@ -322,8 +443,19 @@ class MainWidget(QtWidgets.QWidget):
             # reset so that if an output folder isn't selected it will create a new default folder.
             self.outputfolder_input.clear()
 
-            # long running task so send to ViewWorker to get files, process them and return as a list.
-            self.send_dir_to_process_files.emit(Path(folder))
+            # start with an empty tree, variations are added to it as the ViewWorker finds them.
+            self.model = TreeModel([], Path(folder))
+            self.proxy_model.setSourceModel(self.model)
+            self.tree_view.setModel(self.proxy_model)
+
+            # can't convert until the scan has found every file
+            self.audio_files = None
+            self.non_audio_files = None
+            self.convert_button.setEnabled(False)
+
+            # long running task so send to ViewWorker to get files, process them and send them back a folder at a time.
+            self.scan_generation += 1
+            self.send_dir_to_process_files.emit(Path(folder), self.scan_generation)
             # Show Loading MessageBox
             self.loading.show()
             # Set default output folder path to the same as the input path
@@ -391,6 +523,31 @@ class MainWidget(QtWidgets.QWidget):
                 )
                 return False
 
+            # the same range as the command line's --normalise
+            try:
+                utils.parse_normalise_lufs(self.normalise_input.text())
+            except ValueError as e:
+                QtWidgets.QMessageBox.information(self, "Error", f"Normalise: {e}")
+                return False
+
+            # the same checks as the command line's --channel-matrix
+            if self.channelmatrix_input.text().strip():
+                try:
+                    matrix = utils.parse_channel_matrix(self.channelmatrix_input.text())
+                except ValueError as e:
+                    QtWidgets.QMessageBox.information(
+                        self, "Error", f"Channel matrix: {e}"
+                    )
+                    return False
+                channels = self.channels_input.currentData()
+                if channels and channels != len(matrix):
+                    QtWidgets.QMessageBox.information(
+                        self,
+                        "Error",
+                        f"Channel matrix has {len(matrix)} rows, output channels is {channels}",
+                    )
+                    return False
+
             return True
 
         if validate(self):
@@ -415,6 +572,20 @@ class MainWidget(QtWidgets.QWidget):
                 md = 0
 
             copybool = self.copyfiles_checkbox.isChecked()
+            resume = self.resume_checkbox.isChecked()
+            resample_quality = self.resamplequality_input.currentText()
+            target_samplerate = self.samplerate_input.currentData()
+            target_subtype = self.bitdepth_input.currentData()
+            target_channels = self.channels_input.currentData()
+            dither = self.dither_checkbox.isChecked()
+            measure_loudness = self.loudness_checkbox.isChecked()
+            normalise_lufs = utils.parse_normalise_lufs(self.normalise_input.text())
+            if self.channelmatrix_input.text().strip():
+                channel_matrix = utils.parse_channel_matrix(
+                    self.channelmatrix_input.text()
+                )
+            else:
+                channel_matrix = None
 
             if self._is_processing:
                 return
@@ -431,4 +602,13 @@ class MainWidget(QtWidgets.QWidget):
                 append_tag,
                 self.audio_files,
                 self.non_audio_files,
+                resume,
+                resample_quality,
+                target_samplerate,
+                target_subtype,
+                target_channels,
+                dither,
+                measure_loudness,
+                normalise_lufs,
+                channel_matrix,
             )
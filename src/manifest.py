@@ -0,0 +1,95 @@
+from pathlib import Path
+from dataclasses import asdict
+import json
+import os
+
+"""
+Qt free record of what every output in an output folder was made from, so a re-run only renders what has changed.
+"""
+
+
+MANIFEST_NAME = ".sausage_manifest.json"
+# bump when the layout of an entry changes, older manifests are then ignored.
+MANIFEST_VERSION = 1
+
+
+def fingerprint(file: Path) -> list:
+    """[path, size, mtime_ns] of a file, a file with the same fingerprint is assumed to be unchanged."""
+    stat = os.stat(file)
+    return [str(file), stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest:
+    """
+    Kept as json in the output folder:
+    {"version": 1, "outputs": {output path relative to the output folder: {"sources": [fingerprint, ...], "settings": {...}, "output": fingerprint}}}
+    An output is up to date when its sources and the settings are the same as when it was written, and it hasn't been changed or removed since.
+    """
+
+    def __init__(self, output_folder: Path) -> None:
+        self.output_folder = Path(output_folder)
+        self.path = self.output_folder / MANIFEST_NAME
+        self.outputs = {}
+
+    def load(self) -> None:
+        """read the manifest from the output folder, a missing or unreadable manifest is the same as an empty one."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(manifest, dict) and manifest.get("version") == MANIFEST_VERSION:
+            self.outputs = manifest.get("outputs", {})
+
+    def save(self) -> None:
+        """write the manifest next to the old one and swap them, so an interrupted save never leaves half a manifest."""
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "outputs": self.outputs}, f)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def settings(render_settings, max_duration) -> dict:
+        """the settings that change what is rendered, in the form they are stored in"""
+        settings = asdict(render_settings)
+        # where the files are read from and written to is already part of the paths
+        del settings["input_folder"]
+        del settings["output_folder"]
+        # measuring doesn't change the audio, outputs aren't written again to measure them
+        del settings["measure_loudness"]
+        settings["max_duration"] = max_duration
+
+        # compare with what comes back out of json, i.e tuples are stored as lists
+        return json.loads(json.dumps(settings))
+
+    def key(self, output: Path) -> str:
+        return Path(output).relative_to(self.output_folder).as_posix()
+
+    def is_up_to_date(self, output: Path, sources: list, settings: dict) -> bool:
+        """True if output was written by an earlier run from the same sources with the same settings."""
+        entry = self.outputs.get(self.key(output))
+        if entry is None:
+            return False
+
+        if entry["sources"] != sources or entry["settings"] != settings:
+            return False
+
+        try:
+            return entry["output"] == fingerprint(output)
+        except OSError:
+            # output removed since
+            return False
+
+    def record(self, output: Path, sources: list, settings: dict) -> dict:
+        """record a newly written output, return its entry"""
+        entry = {
+            "sources": sources,
+            "settings": settings,
+            "output": fingerprint(output),
+        }
+        self.outputs[self.key(output)] = entry
+
+        return entry
@@ -1,16 +1,31 @@
+import mmap
 import struct
 from io import BytesIO
 
 import exceptions
 
+# chunks other than fmt and data that describe the audio, they aren't copied to a new file
+AUDIO_CHUNKS = (b"PEAK", b"fact")
+
 
 class Metadata_Parser:
 
-    def __init__(self, from_file) -> None:
-        """from file is a buffered file read with bytes"""
-        self.file_bytes = BytesIO(from_file.read())
+    def __init__(self, from_file, lazy=False) -> None:
+        """from file is a buffered file read with bytes.
+        lazy parsers don't copy the file, they memory map it and seek over the data chunk,
+        so only the headers and metadata chunks are read from disk. self.data is left as None,
+        use self.chunks or self.chunk() to get to the audio."""
+        self.lazy = lazy
+        if lazy:
+            self.file_bytes = self._map_file(from_file)
+        else:
+            self.file_bytes = BytesIO(from_file.read())
+        # index of (sub_chunk_id, offset of the chunk content, sub_chunk_size) in file order
+        self.chunks = []
         # defaults
         self.generic_metadata = b""
+        # (sub_chunk_id, chunk bytes) of each chunk in generic_metadata
+        self.generic_chunks = []
         self.generic_metadata_info = {}
         self.header = None
         self.header_info = None
@@ -20,9 +35,53 @@ class Metadata_Parser:
         self.data_info = None
         self.read()
 
+    @staticmethod
+    def _map_file(from_file):
+        """memory map a real file, anything else (i.e BytesIO) is used as it is."""
+        try:
+            return mmap.mmap(from_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError):
+            return from_file
+        except ValueError:
+            # can't mmap an empty file
+            raise exceptions.EmptyFileExeption("File does not contain any bytes!")
+
+    def _skip(self, number_of_bytes):
+        """seek over bytes without reading them, never past the end of the file"""
+        self.file_bytes.seek(
+            min(self.file_bytes.tell() + number_of_bytes, self.file_length)
+        )
+
+    def _index_chunk(self, sub_chunk_id, sub_chunk_size):
+        """call straight after reading the size, when the file position is the start of the chunk content"""
+        self.chunks.append((sub_chunk_id, self.file_bytes.tell(), sub_chunk_size))
+
+    def chunk(self, sub_chunk_id) -> memoryview:
+        """return the content of the first chunk with the given id, or None if there isn't one.
+        lazy parsers return a view into the memory mapped file so the chunk isn't copied.
+        """
+        for chunk_id, offset, sub_chunk_size in self.chunks:
+            if chunk_id != sub_chunk_id:
+                continue
+
+            if isinstance(self.file_bytes, BytesIO):
+                view = self.file_bytes.getbuffer()
+            elif isinstance(self.file_bytes, mmap.mmap):
+                view = memoryview(self.file_bytes)
+            else:
+                self.file_bytes.seek(offset)
+                return memoryview(self.file_bytes.read(sub_chunk_size))
+
+            return view[offset : offset + sub_chunk_size]
+
+        return None
+
     def _read_header(self):
 
-        if not len(self.file_bytes.read()) > 0:
+        # find the length without reading the file
+        self.file_bytes.seek(0, 2)
+        self.file_length = self.file_bytes.tell()
+        if not self.file_length > 0:
             raise exceptions.EmptyFileExeption("File does not contain any bytes!")
         self.file_bytes.seek(0)
 
@@ -53,6 +112,7 @@ class Metadata_Parser:
         sub_chunk_size = struct.unpack("<I", self.file_bytes.read(4))[0]
         if not isinstance(sub_chunk_size, int):
             raise exceptions.FormatChunkError("sub_chunk_size is not an int")
+        self._index_chunk(sub_chunk_id, sub_chunk_size)
 
         audio_format = struct.unpack("<H", self.file_bytes.read(2))[0]
         if not isinstance(audio_format, int):
@@ -124,6 +184,17 @@ class Metadata_Parser:
         sub_chunk_size = struct.unpack("<I", self.file_bytes.read(4))[0]
         if not isinstance(sub_chunk_size, int):
             raise exceptions.InvalidSizeValue("Data sub_chunk_size is not an int")
+        self._index_chunk(sub_chunk_id, sub_chunk_size)
+
+        self.data_info = {
+            "sub_chunk_id": sub_chunk_id,
+            "sub_chunk_size": sub_chunk_size,
+        }
+
+        # the audio isn't needed to read metadata, skip over it including the word align byte
+        if self.lazy:
+            self._skip(sub_chunk_size + sub_chunk_size % 2)
+            return
 
         # read all content of sub chunk
         content = self.file_bytes.read(sub_chunk_size)
@@ -134,11 +205,6 @@ class Metadata_Parser:
             content += b"\x00"
             # print("WORD ALIGN GO! - Data Chunk")
 
-        self.data_info = {
-            "sub_chunk_id": sub_chunk_id,
-            "sub_chunk_size": sub_chunk_size,
-        }
-
         # pack and append
         packed_sub_chunk_size = struct.pack("<I", sub_chunk_size)
         self.data = b"".join([sub_chunk_id, packed_sub_chunk_size, content])
@@ -149,6 +215,7 @@ class Metadata_Parser:
         sub_chunk_size = struct.unpack("<I", self.file_bytes.read(4))[0]
         if not isinstance(sub_chunk_size, int):
             raise exceptions.InvalidSizeValue("sub_chunk_size is not an int")
+        self._index_chunk(sub_chunk_id, sub_chunk_size)
 
         # read all content of sub chunk
         content = self.file_bytes.read(sub_chunk_size)
@@ -163,21 +230,22 @@ class Metadata_Parser:
             content += b"\x00"
             # print("WORD ALIGN GO! - Metadata chunk")
 
-        self.generic_metadata += b"".join(
-            [sub_chunk_id, packed_sub_chunk_size, content]
-        )
+        chunk = b"".join([sub_chunk_id, packed_sub_chunk_size, content])
+        self.generic_chunks.append((sub_chunk_id, chunk))
+        self.generic_metadata += chunk
 
     def _skip_DGDA(self, sub_chunk_id):
         """DGDA is a weird avid chunk that's different for each file"""
         sub_chunk_size = struct.unpack("<I", self.file_bytes.read(4))[0]
         if not isinstance(sub_chunk_size, int):
             raise exceptions.InvalidSizeValue("sub_chunk_size is not an int")
+        self._index_chunk(sub_chunk_id, sub_chunk_size)
 
-        self.file_bytes.read(sub_chunk_size)
+        self._skip(sub_chunk_size)
 
         # word align by adding a byte if chunk size isn't an even number. - chunks MUST be an even size (this may only be data chunk?)
         if sub_chunk_size % 2 != 0:
-            self.file_bytes.read(1)
+            self._skip(1)
             # content += b"\x00"
             # print("WORD ALIGN GO! - Metadata chunk")
 
@@ -212,62 +280,159 @@ class Metadata_Parser:
                 raise exceptions.SubchunkIDParsingError
 
 
+def read_audio_header(in_file) -> dict:
+    """
+    Read the fmt chunk and the size of the data chunk without reading any audio or metadata,
+    chunk headers are walked by seeking over their contents.
+    in_file is a file opened to read bytes.
+    """
+    in_file.seek(0, 2)
+    file_length = in_file.tell()
+    in_file.seek(0)
+
+    header = in_file.read(12)
+    if len(header) < 12:
+        raise exceptions.EmptyFileExeption("File does not contain any bytes!")
+    if header[0:4] != b"RIFF":
+        raise exceptions.InvalidRIFFFileException("Not a RIFF File")
+    if header[8:12] != b"WAVE":
+        raise exceptions.InvalidWavFileException("Not a WAVE file")
+
+    audio_header = None
+
+    chunk_header = in_file.read(8)
+    while len(chunk_header) == 8:
+        sub_chunk_id = chunk_header[0:4]
+        sub_chunk_size = struct.unpack("<I", chunk_header[4:8])[0]
+        chunk_start = in_file.tell()
+
+        if sub_chunk_id == b"fmt ":
+            fmt = in_file.read(min(sub_chunk_size, 40))
+            if len(fmt) < 16:
+                raise exceptions.FormatChunkError("fmt chunk is too short")
+
+            (
+                audio_format,
+                num_channels,
+                sample_rate,
+                byte_rate,
+                block_align,
+                bits_per_sample,
+            ) = struct.unpack("<HHIIHH", fmt[0:16])
+
+            # WAVE_FORMAT_EXTENSIBLE keeps the real format in the first two bytes of the sub format GUID
+            if audio_format == 0xFFFE and len(fmt) >= 26:
+                audio_format = struct.unpack("<H", fmt[24:26])[0]
+
+            audio_header = {
+                "audio_format": audio_format,
+                "number_of_channels": num_channels,
+                "sample_rate": sample_rate,
+                "byte_rate": byte_rate,
+                "block_align": block_align,
+                "bits_per_sample": bits_per_sample,
+            }
+
+        elif sub_chunk_id == b"data":
+            if audio_header is None:
+                raise exceptions.FormatChunkError("data chunk before fmt chunk")
+
+            # files that were never finished can claim more data than they have
+            audio_header["data_offset"] = chunk_start
+            audio_header["data_size"] = min(sub_chunk_size, file_length - chunk_start)
+            return audio_header
+
+        # chunks MUST be an even size, odd sized chunks are followed by a pad byte
+        in_file.seek(chunk_start + sub_chunk_size + sub_chunk_size % 2)
+        chunk_header = in_file.read(8)
+
+    raise exceptions.InvalidWavFileException("No data chunk in file")
+
+
 class Metadata_Assembler:
     """Metadata Assembler class is designed to:
     read the metadata from the original given file
-    read the header, data and fmt from the newly created file
-    and then combine them together in the same location as the new file, re-writing it with the combined content.
+    find the end of the data chunk in the newly created file by seeking over the chunk headers
+    and then append the metadata to the new file in place, the audio is never read back into memory.
     the combined content also required changing the header's size information to the new combined file size.
+
+    splice() works on a file that is still open, so a new file can have its audio and metadata written in one pass.
     """
 
     def __init__(self, original_filename, new_filename) -> None:
         self.new_filename = new_filename
         self.original_filename = original_filename
+        self.other_chunks = None
+
+    def read_original(self) -> bytes:
+        """read misc metadata from original file, this can be called before the new file is written so broken metadata fails early"""
+        if self.other_chunks is None:
+            with open(self.original_filename, "rb") as in_file:
+                file1 = Metadata_Parser(in_file, lazy=True)
 
-    def _read_original(self):
-        """read misc metadata from original file"""
-        # print(self.original_filename)
-        with open(self.original_filename, "rb") as in_file:
-            file1 = Metadata_Parser(in_file)
-            # print(file1.generic_metadata_info)
+            # PEAK and fact describe the original's audio, libsndfile writes the new file's own when it needs them.
+            self.other_chunks = b"".join(
+                chunk
+                for sub_chunk_id, chunk in file1.generic_chunks
+                if sub_chunk_id not in AUDIO_CHUNKS
+            )
 
-        return file1.generic_metadata
+        return self.other_chunks
 
-    def _read_new_filename(self):
-        with open(self.new_filename, "rb") as in_file:
-            file2 = Metadata_Parser(in_file)
-            # print(file2.header_info)
-            # print(file2.fmt_info)
-            # print(file2.data_info)
+    def _find_data_chunk_end(self, out_file) -> int:
+        """Walk the chunk headers of the new file, seeking over their contents, and return the position the data chunk ends at."""
+        out_file.seek(0)
 
-        header_format_data = b"".join([file2.header, file2.fmt, file2.data])
+        header = out_file.read(12)
+        if len(header) < 12:
+            raise exceptions.EmptyFileExeption("File does not contain any bytes!")
+        if header[0:4] != b"RIFF":
+            raise exceptions.InvalidRIFFFileException("Not a RIFF File")
+        if header[8:12] != b"WAVE":
+            raise exceptions.InvalidWavFileException("Not a WAVE file")
+
+        chunk_header = out_file.read(8)
+        while len(chunk_header) == 8:
+            sub_chunk_id = chunk_header[0:4]
+            sub_chunk_size = struct.unpack("<I", chunk_header[4:8])[0]
+
+            # chunks MUST be an even size, odd sized chunks are followed by a pad byte
+            chunk_end = out_file.tell() + sub_chunk_size + sub_chunk_size % 2
 
-        return header_format_data
+            if sub_chunk_id == b"data":
+                return chunk_end
 
-    def _update_header_file_size(self, blob: bytes):
-        """New data blob will still have the file size from the old half, so write the new value into the header and return it!"""
-        b = BytesIO(blob)
+            out_file.seek(chunk_end)
+            chunk_header = out_file.read(8)
 
-        file_size = len(blob) - 8
+        raise exceptions.InvalidWavFileException("No data chunk in new file")
+
+    def _update_header_file_size(self, out_file):
+        """New file will still have the file size from before the metadata was added, so write the new value into the header"""
+        file_size = out_file.seek(0, 2) - 8
         # pack into struct
         packed_file_size = struct.pack("<I", file_size)
 
         # find size position
-        b.seek(4)
-        b.write(packed_file_size)
-        # go back to the start
-        b.seek(0)
-        new_bytes = b.read()
+        out_file.seek(4)
+        out_file.write(packed_file_size)
 
-        return new_bytes
+    def splice(self, out_file):
+        """append the original metadata to the new file, out_file is the new file opened to read and write bytes"""
+        other_chunks = self.read_original()
 
-    def assemble(self):
-        header_fmt_data = self._read_new_filename()
-        other_chunks = self._read_original()
+        data_end = self._find_data_chunk_end(out_file)
 
-        blob = b"".join([header_fmt_data, other_chunks])
+        # anything after the data chunk is replaced by the original metadata
+        out_file.truncate(data_end)
+        # the pad byte of an odd sized data chunk may not have been written
+        out_file.seek(0, 2)
+        out_file.write(b"\x00" * (data_end - out_file.tell()))
 
-        updated_blob = self._update_header_file_size(blob)
+        out_file.write(other_chunks)
 
-        with open(self.new_filename, "wb") as out_file:
-            out_file.write(updated_blob)
+        self._update_header_file_size(out_file)
+
+    def assemble(self):
+        with open(self.new_filename, "r+b") as out_file:
+            self.splice(out_file)
@@ -0,0 +1,636 @@
+from pathlib import Path
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import datetime
+import json
+
+import utils
+import copier
+import probe
+from manifest import Manifest, fingerprint
+from journal import Journal
+from records import DEFAULT_RESAMPLE_QUALITY, ReportObject, RenderSettings
+
+"""
+The conversion pipeline without Qt, so it can run from the command line on machines without a display.
+mainwindow runs it through worker.Worker, cli.py runs it on its own.
+"""
+
+
+def loudness_text(result: dict) -> str:
+    """peak, RMS and loudness for the report. Silence has a peak and RMS of -inf,
+    loudness is n/a for anything shorter than 400ms or below the -70 LUFS gate.
+    """
+
+    def value(number, missing):
+        return missing if number is None else f"{number:.1f}"
+
+    return (
+        f"Peak: {value(result['peak_dbfs'], '-inf')} dBFS"
+        f" - RMS: {value(result['rms_dbfs'], '-inf')} dBFS"
+        f" - Loudness: {value(result['integrated_lufs'], 'n/a')} LUFS"
+    )
+
+
+def gain_text(gain_db: float | None) -> str:
+    """gain normalising applied to a variation, n/a if it couldn't be measured and was left as it was."""
+    if gain_db is None:
+        return "Gain: n/a"
+    return f"Gain: {gain_db:+.1f} dB"
+
+
+class Signal:
+    """Stand in for QtCore.Signal, slots connected to it are called straight away in the thread that emits."""
+
+    def __init__(self, *types) -> None:
+        self.types = types
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        # each instance has its own connections, like a bound Qt signal
+        bound = instance.__dict__.get(self.name)
+        if bound is None:
+            bound = instance.__dict__[self.name] = BoundSignal()
+        return bound
+
+
+class BoundSignal:
+    def __init__(self) -> None:
+        self.slots = []
+
+    def connect(self, slot) -> None:
+        self.slots.append(slot)
+
+    def emit(self, *args) -> None:
+        for slot in self.slots:
+            slot(*args)
+
+
+class Pipeline:
+    """
+    scan results -> group -> filter -> render -> copy -> report, with no Qt.
+    Progress goes out through the same signals the GUI's Worker has, they are plain callbacks here and Qt signals on the Worker.
+    """
+
+    def __init__(self, ctrl, max_workers: int = None) -> None:
+        self.ctrl = ctrl
+        self.ctrl["files_scanned"] = 0
+        self.ctrl["files_created"] = 0
+        # number of render processes, None lets the ProcessPoolExecutor use every core
+        self.max_workers = max_workers
+
+        self.create_report_path()
+        self.report = None
+        self.errored_files: list[ReportObject] = []
+        self.copied_files: list[Path] = []
+        # outputs that were left as they were because nothing has changed since the last run
+        self.unchanged_files: list[Path] = []
+        # variation groups that weren't rendered because the conversion was cancelled
+        self.cancelled_groups: list[list[Path]] = []
+        # measured peak, RMS and loudness of each output and the gains normalising applied, written next to the report as json
+        self.loudness_entries: list[dict] = []
+        # properties of every audio file probed this session, shared by the filter, render and report stages
+        self.properties_cache = probe.PropertiesCache()
+
+    number_of_files = Signal(int, str)
+    progress = Signal(int)
+    logger = Signal(str, bool, str, str)
+    finished_processing = Signal(bool)
+
+    def all_inputs(
+        self,
+        inputfolder_input,
+        outputfolder_input,
+        silenceduration_input,
+        maxduration_input,
+        copybool,
+        view_filtered_list,
+        append_tag,
+        audio_files,
+        non_audio_files,
+        resume=False,
+        resample_quality=DEFAULT_RESAMPLE_QUALITY,
+        target_samplerate=0,
+        target_subtype="",
+        target_channels=0,
+        dither=False,
+        measure_loudness=False,
+        normalise_lufs=None,
+        channel_matrix=None,
+    ):
+        self.input_folder = Path(inputfolder_input)
+        self.output_folder = Path(outputfolder_input)
+        self.silence_duration = silenceduration_input
+        self.max_duration = maxduration_input
+        self.copybool = copybool
+        self.view_filtered_list = view_filtered_list
+        self.append_tag = append_tag
+        self.audio_files = audio_files
+        self.non_audio_files = non_audio_files
+        # carry on from the journal of an interrupted run into the same output folder
+        self.resume = resume
+        self.resample_quality = resample_quality
+        # every group is converted to this format, 0 or "" keeps the format of the group's variations
+        self.target_samplerate = target_samplerate or None
+        self.target_subtype = target_subtype or None
+        self.target_channels = target_channels or None
+        self.dither = dither
+        # gains to mix variations to the output channels with instead of their layout's, see channel_layouts.mix_matrix
+        self.channel_matrix = channel_matrix
+        # measuring is off unless it's asked for, it costs a K-weighting filter over every block written
+        self.measure_loudness = measure_loudness
+        # loudness in LUFS every variation is brought to before it is appended, None leaves them as they are
+        self.normalise_lufs = normalise_lufs
+
+        # if there was no output folder given, it is set to the same as the input folder, this is then appended with _sausage
+        if self.input_folder == self.output_folder:
+            self.output_folder = utils.create_default_file_path(self.output_folder)
+
+        # create a new report each time a folder is selected
+        self.create_md_report()
+
+        tokenized = utils.split_paths_to_tokens(view_filtered_list)
+        files_with_variations = utils.group_files_by_variation(tokenized)
+
+        # sort durations
+        correct_duration_list = self.remove_too_long_files(
+            files_with_variations, self.max_duration
+        )
+
+        # sort files to be copied, this is done before appending so that failed files can be added to it.
+        if copybool is True:
+            self.files_without_variations = utils.find_files_without_variations(
+                correct_duration_list, audio_files
+            )
+
+            self.files_without_variations.extend(self.non_audio_files)
+
+            # folders without any variations are copied whole instead of file by file
+            self.files_without_variations = utils.plan_copy_jobs(
+                self.files_without_variations,
+                correct_duration_list,
+                self.input_folder,
+            )
+
+            # start copying straight away, the copies run alongside the appending.
+            self.copier = copier.CopyEngine(self.input_folder, self.output_folder)
+            for file in self.files_without_variations:
+                self.copier.submit(file)
+
+        # append
+        if len(correct_duration_list) > 0:
+            self.file_append_pool(correct_duration_list)
+
+        # copy to out
+        if copybool is True:
+            self.file_copy_pool(self.files_without_variations)
+
+        self.finish()
+
+    def finish(self):
+        """all processing is finished, generate the report."""
+        if self.unchanged_files:
+            self.add_unchanged_files_to_report()
+        if self.cancelled_groups:
+            self.add_cancelled_groups_to_report()
+        if self.errored_files:
+            self.add_errors_to_report()
+        if self.copybool:
+            self.add_copied_files_to_report(self.copied_files)
+
+        self.report.create_md_file()
+        if self.loudness_entries:
+            self.write_loudness_report()
+        self.finished_processing.emit(True)
+
+    def create_report_path(self):
+        """If a reports folder hasn't been created in appdata, create one"""
+        appname = "SausageFileConverter"
+        appauthor = "SoundSpruce"
+
+        import platformdirs
+
+        path = platformdirs.user_data_path(appname, appauthor, ensure_exists=False)
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        self.report_path = path
+
+    def create_md_report(self):
+        """Initialise the creation of a markdown report and empty list of files with errors"""
+        import mdutils
+
+        self.report = mdutils.MdUtils(
+            file_name=f'{self.report_path}/SausageFileConverterReport_{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}',
+            title="Sausage File Converter Report",
+        )
+
+        self.errored_files: list[ReportObject] = []
+        self.copied_files = []
+        self.unchanged_files = []
+        self.cancelled_groups = []
+        self.loudness_entries = []
+
+    def add_converted_files_to_report(self, reportobj: ReportObject):
+        """Add the name and length of the output file and a list of the files that went into it."""
+        bullet_points = []
+
+        # convert the list of file paths to strings containing the original name, channel count, samplerate, bit depth and if they have been converted.
+        for i in range(len(reportobj.single_variation_list)):
+            original_file_name = str(reportobj.single_variation_list[i])
+            channel = str(reportobj.channels_list[i])
+            sample_rate = str(reportobj.sample_rates[i])
+            subtype = reportobj.subtypes[i]
+
+            if int(channel) != reportobj.channels:
+                channel += f" -> Converted to: {reportobj.channels}"
+
+            if int(sample_rate) != reportobj.samplerate:
+                sample_rate += f" -> Converted to: {reportobj.samplerate}"
+
+            if subtype != reportobj.subtype:
+                subtype += f" -> Converted to: {reportobj.subtype}"
+
+            bullet_point = f"{original_file_name} - Channels: {channel} - Sample Rate: {sample_rate} - Format: {subtype}"
+            if reportobj.variation_loudness:
+                bullet_point += f" - {loudness_text(reportobj.variation_loudness[i])}"
+            if reportobj.gains_db:
+                bullet_point += f" - {gain_text(reportobj.gains_db[i])}"
+            bullet_points.append(bullet_point)
+
+        # the length was worked out while the file was written, so it isn't opened again
+        new_length = datetime.timedelta(seconds=int(reportobj.length))
+
+        output_line = f"{str(reportobj.new_file_name_path)}, Length: {new_length}"
+        if reportobj.loudness is not None:
+            output_line += f", {loudness_text(reportobj.loudness)}"
+
+        # the json has whichever of the measurements and normalising gains there are
+        if reportobj.loudness is not None or reportobj.gains_db:
+            variations = [
+                {"file": str(file)} for file in reportobj.single_variation_list
+            ]
+            for variation, result in zip(variations, reportobj.variation_loudness):
+                variation.update(result)
+            for variation, gain_db in zip(variations, reportobj.gains_db):
+                variation["gain_db"] = gain_db
+
+            self.loudness_entries.append(
+                {
+                    "output": str(reportobj.new_file_name_path),
+                    "length": reportobj.length,
+                    **(reportobj.loudness or {}),
+                    "variations": variations,
+                }
+            )
+
+        self.report.new_list([output_line, bullet_points])
+
+    def loudness_report_path(self) -> Path:
+        return Path(f"{self.report.file_name}.json")
+
+    def write_loudness_report(self):
+        """the measurements and normalising gains of every converted file, for other tools to read"""
+        with open(self.loudness_report_path(), "w", encoding="utf-8") as f:
+            json.dump({"outputs": self.loudness_entries}, f, indent=2)
+
+    def add_unchanged_files_to_report(self):
+        """outputs that were already up to date from an earlier run"""
+        self.report.new_header(level=1, title="Unchanged files")
+        path_to_str = [str(p) for p in self.unchanged_files]
+
+        self.report.new_list([path_to_str])
+
+    def add_cancelled_groups_to_report(self):
+        """variations that weren't appended because the conversion was cancelled, they can be resumed."""
+        self.report.new_header(level=1, title="Cancelled")
+        path_to_str = [str(lst[0]) for lst in self.cancelled_groups]
+
+        self.report.new_list([path_to_str])
+
+    def add_copied_files_to_report(self, files_without_variations):
+
+        self.report.new_header(level=1, title="Copied files")
+        path_to_str = [str(p) for p in files_without_variations]
+
+        self.report.new_list([path_to_str])
+
+    def add_errors_to_report(self):
+
+        self.report.new_header(level=1, title="Files that caused Errors")
+
+        obj_to_str = [
+            f"{e.original_file_name}: {str(e.error)}" for e in self.errored_files
+        ]
+        self.report.new_list(obj_to_str)
+
+    def remove_too_long_files(
+        self, files_with_variations: list[list[Path]], max_duration
+    ) -> list:
+        """Remove files that are too long from the files_with_variations list of lists"""
+        correct_duration_list = []
+
+        # if the max duration GUI box has been left empty, return the full list.
+        if max_duration == 0:
+            return files_with_variations
+
+        # flatten list to get count to pass to progress bar
+        files_with_vars = []
+        for files in files_with_variations:
+            files_with_vars.extend(files)
+        self.number_of_files.emit(len(files_with_vars), "Analysing...")
+
+        # lengths are read from the file headers, several files at a time
+        short_enough = set()
+        durations = self.properties_cache.probe_all(files_with_vars)
+        for count, (file, audio_properties) in enumerate(durations, start=1):
+
+            # if cancel button pressed
+            if self.ctrl["break"] is True:
+                durations.close()
+                self.progress.emit(len(files_with_vars))
+                return files_with_variations
+
+            # files that can't be read have no length and are left out
+            if (
+                audio_properties is not None
+                and audio_properties.duration < max_duration
+            ):
+                short_enough.add(file)
+
+            # update progress bar
+            self.progress.emit(count)
+
+        for variations in files_with_variations:
+            variations_of_correct_size = [
+                file for file in variations if file in short_enough
+            ]
+
+            if (
+                len(variations_of_correct_size) > 1
+            ):  # don't add empty list or list of one
+                correct_duration_list.append(variations_of_correct_size)
+
+        return correct_duration_list
+
+    def copy_files_without_variations_to_out(self, file: Path) -> Path:
+        """copy a file that didn't have variations to its output folder in the current thread, see copier.copy_path"""
+        return copier.copy_path(file, self.input_folder, self.output_folder)
+
+    def copy_handler(self, result: copier.CopyResult):
+        """Handle the result of a copy in the Worker thread, log it to the GUI and keep track of what was copied."""
+        if result.cancelled:
+            return
+
+        if result.error is not None:
+            print(f"{result.error}: file: {result.source}")
+            self.logger.emit("Copy", False, str(result.source), str(result.error))
+            return
+
+        print(f"Copy: {result.source} to: {result.destination}")
+        self.logger.emit("Copy", True, str(result.source), str(result.destination))
+        self.copied_files.append(result.source)
+
+    def concatination_handler(self, reportobj: ReportObject):
+        """Handle the result of a rendered variation group in the Worker thread.
+        Log it to the GUI, add it to the report and queue failed variations to be copied.
+        """
+
+        if reportobj.error is not None:
+            # GUI out
+            self.logger.emit(
+                "Write", False, str(reportobj.original_file_name), str(reportobj.error)
+            )
+            # Report out
+            self.errored_files.append(reportobj)
+            self.journal.failed(
+                self.manifest.key(self.group_outputs[reportobj.original_file_name]),
+                reportobj.error,
+            )
+
+            if self.copybool:
+                self.files_without_variations.extend(reportobj.single_variation_list)
+                for file in reportobj.single_variation_list:
+                    self.copier.submit(file)
+
+        else:
+            self.logger.emit(
+                "Write",
+                True,
+                str(reportobj.original_file_name),
+                str(reportobj.new_file_name_path),
+            )
+
+            self.add_converted_files_to_report(reportobj)
+            self.ctrl["files_created"] += 1
+
+            if self.sources.get(reportobj.new_file_name_path) is not None:
+                entry = self.manifest.record(
+                    reportobj.new_file_name_path,
+                    self.sources[reportobj.new_file_name_path],
+                    self.manifest_settings,
+                )
+                self.journal.done(
+                    self.manifest.key(reportobj.new_file_name_path), entry
+                )
+
+        # count is emmited up to n-1, then last count is emitted after the pool has finished
+        self.progress.emit(self.count)
+        self.count += 1
+
+    def unchanged_handler(self, single_variation_list: list[Path], output: Path):
+        """Log a variation group that wasn't rendered because its output is up to date."""
+        print(f"Unchanged: {output}")
+        self.logger.emit("Unchanged", True, str(single_variation_list[0]), str(output))
+        self.unchanged_files.append(output)
+
+        self.progress.emit(self.count)
+        self.count += 1
+
+    def cancel_groups(self, groups: list[list[Path]]):
+        """variation groups that won't be submitted because the conversion was cancelled, queued copies are skipped too."""
+        self.cancelled_groups.extend(groups)
+        if self.copybool:
+            self.copier.cancel()
+
+    def file_append_pool(self, files_with_correct_size_variations: list[list[Path]]):
+        """create multi-process pool to append files"""
+        # Progress bar setup, min = count = 0, max = number of files
+        self.count = 0
+        self.number_of_files.emit(
+            len(files_with_correct_size_variations), "Appending..."
+        )
+        self.report.new_header(level=1, title="Converted Files")
+
+        # cancelled before appending started, nothing is fingerprinted, journaled or rendered.
+        if self.ctrl["break"] is True:
+            self.cancel_groups(files_with_correct_size_variations)
+            self.progress.emit(len(files_with_correct_size_variations))
+            return
+
+        # render loads numpy, soxr and soundfile, so it isn't imported until there is something to append.
+        import render
+
+        settings = RenderSettings(
+            silence_duration=self.silence_duration,
+            input_folder=self.input_folder,
+            output_folder=self.output_folder,
+            append_tag=self.append_tag,
+            resample_quality=self.resample_quality,
+            target_samplerate=self.target_samplerate,
+            target_subtype=self.target_subtype,
+            target_channels=self.target_channels,
+            channel_matrix=self.channel_matrix,
+            dither=self.dither,
+            measure_loudness=self.measure_loudness,
+            normalise_lufs=self.normalise_lufs,
+        )
+
+        # groups whose sources and settings haven't changed since the last run into this output folder are skipped.
+        self.manifest = Manifest(self.output_folder)
+        self.manifest.load()
+        self.manifest_settings = Manifest.settings(settings, self.max_duration)
+        self.sources = {}
+        self.group_outputs = {}
+
+        # groups are journaled as they are queued and finish, a resumed run treats the groups finished before it stopped like the manifest's.
+        self.journal = Journal(self.output_folder)
+        if self.resume:
+            self.manifest.outputs.update(self.journal.done_entries())
+        # a run that was killed, rather than cancelled, can leave the half written outputs of the groups it was rendering.
+        for key in self.journal.unfinished():
+            render.partial_path(self.output_folder / key).unlink(missing_ok=True)
+        self.journal.open(resume=self.resume)
+
+        groups_to_render = []
+        for index, lst in enumerate(files_with_correct_size_variations):
+            if self.ctrl["break"] is True:
+                self.cancel_groups(files_with_correct_size_variations[index:])
+                break
+
+            output = render.output_path(
+                lst, self.input_folder, self.output_folder, self.append_tag
+            )
+            try:
+                sources = [fingerprint(file) for file in lst]
+            except OSError:
+                # removed since the scan, rendering it will report the error
+                sources = None
+
+            if sources is not None and self.manifest.is_up_to_date(
+                output, sources, self.manifest_settings
+            ):
+                self.unchanged_handler(lst, output)
+                continue
+
+            self.sources[output] = sources
+            self.group_outputs[lst[0]] = output
+            self.journal.pending(self.manifest.key(output), lst)
+            groups_to_render.append(lst)
+
+        # every queued group is on disk in one go, before anything is rendered.
+        self.journal.sync()
+
+        if self.ctrl["break"] is True:
+            self.cancel_groups(groups_to_render)
+            groups_to_render = []
+
+        # files that were filtered by duration are already in the cache, anything else is probed here.
+        all_variations = [file for lst in groups_to_render for file in lst]
+        properties = dict(self.properties_cache.probe_all(all_variations))
+
+        # spawn instead of fork, forking a process that is running Qt threads isn't safe.
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=render.ignore_interrupts,
+        ) as p_executor:  # using a context manager joins, so blocks
+            futures = {}
+            for index, lst in enumerate(groups_to_render):
+                if self.ctrl["break"] is True:
+                    self.cancel_groups(groups_to_render[index:])
+                    break
+
+                future = p_executor.submit(
+                    render.render_variation_group,
+                    lst,
+                    settings,
+                    [properties[file] for file in lst],
+                )
+                futures[future] = lst
+
+            # results are handled in this thread as they finish, so the report and GUI are only touched from here.
+            for future in concurrent.futures.as_completed(futures):
+                # if cancel button pressed, don't start any more groups, the ones already running are finished.
+                if self.ctrl["break"] is True:
+                    for f in futures:
+                        f.cancel()
+                    if self.copybool:
+                        self.copier.cancel()
+
+                if future.cancelled():
+                    self.cancelled_groups.append(futures[future])
+                    continue
+
+                try:
+                    reportobj = future.result()
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    # a render process died, every group that hadn't finished fails with it.
+                    reportobj = ReportObject(futures[future])
+                    reportobj.error = e
+
+                self.concatination_handler(reportobj)
+
+                # log any copies that have finished while appending, without waiting for the rest.
+                if self.copybool:
+                    for result in self.copier.collect():
+                        self.copy_handler(result)
+
+            # When all are done, send the last percent to the update bar
+            self.progress.emit(len(files_with_correct_size_variations))
+
+        # save what was written, including when cancelled.
+        self.manifest.save()
+
+        # a finished run is all in the manifest, a cancelled one keeps its journal to be resumed.
+        if self.cancelled_groups:
+            self.journal.close()
+        else:
+            self.journal.remove()
+
+    def file_copy_pool(self, files_without_variations):
+        """wait for the copies queued on the copy engine to finish, nothing else is submitted after this is called."""
+        self.copier.close()
+
+        # Progress bar setup, copies that finished while appending count towards it
+        self.count = len(files_without_variations) - self.copier.outstanding()
+        self.number_of_files.emit(len(files_without_variations), "Copying...")
+        self.progress.emit(self.count)
+
+        for result in self.copier.collect(block=True):
+            if self.ctrl["break"] is True:
+                self.copier.cancel()
+
+            self.copy_handler(result)
+            self.count += 1
+            self.progress.emit(self.count)
+
+    def file_append(
+        self,
+        reportobj: ReportObject,
+        silence_duration: float,
+        input_folder: Path,
+        output_folder: Path,
+        append_tag: str,
+    ) -> Path:
+        """Append one set of variations in the current thread, see render.file_append"""
+        import render
+
+        return render.file_append(
+            reportobj, silence_duration, input_folder, output_folder, append_tag
+        )
@@ -0,0 +1,159 @@
+from pathlib import Path
+from dataclasses import dataclass
+import concurrent.futures
+import os
+import threading
+
+import exceptions
+from metadata_v2 import read_audio_header
+
+"""
+Qt free audio property probes. Most files are plain PCM or float wavs, everything needed about them is in their headers,
+so they are never opened with libsndfile. Anything else is left to libsndfile.
+"""
+
+
+# number of files probed at once, probing is mostly waiting on the disk.
+PROBE_WORKERS = 16
+
+# (wave format tag, bits per sample) -> libsndfile subtype, for formats where every block_align bytes of the data chunk is one frame.
+# 1 PCM, 3 IEEE float
+PLAIN_SUBTYPES = {
+    (1, 8): "PCM_U8",
+    (1, 16): "PCM_16",
+    (1, 24): "PCM_24",
+    (1, 32): "PCM_32",
+    (3, 32): "FLOAT",
+    (3, 64): "DOUBLE",
+}
+
+# errors that mean the headers can't be read by the RIFF parser, libsndfile may still be able to.
+HEADER_ERRORS = (
+    exceptions.InvalidRIFFFileException,
+    exceptions.InvalidWavFileException,
+    exceptions.EmptyFileExeption,
+    exceptions.FormatChunkError,
+)
+
+
+@dataclass(frozen=True)
+class AudioProperties:
+    """Properties of an audio file, named like soundfile.info's so either can be used by the render stage"""
+
+    samplerate: int
+    channels: int
+    subtype: str
+    frames: int
+    # offset and size in bytes of the data chunk's content, None for files that weren't read by the RIFF parser
+    data_offset: int | None = None
+    data_size: int | None = None
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.samplerate
+
+
+def libsndfile_properties(file: Path) -> AudioProperties:
+    """read the properties with libsndfile, raises soundfile.LibsndfileError if it can't open the file"""
+    import soundfile
+
+    info = soundfile.info(file)
+    return AudioProperties(
+        samplerate=info.samplerate,
+        channels=info.channels,
+        subtype=info.subtype,
+        frames=info.frames,
+    )
+
+
+def properties(file: Path) -> AudioProperties | None:
+    """properties of an audio file, or None if it can't be read"""
+    try:
+        with open(file, "rb") as in_file:
+            audio_header = read_audio_header(in_file)
+
+        subtype = PLAIN_SUBTYPES.get(
+            (audio_header["audio_format"], audio_header["bits_per_sample"])
+        )
+        if (
+            subtype is not None
+            and audio_header["block_align"] > 0
+            and audio_header["sample_rate"] > 0
+        ):
+            return AudioProperties(
+                samplerate=audio_header["sample_rate"],
+                channels=audio_header["number_of_channels"],
+                subtype=subtype,
+                frames=audio_header["data_size"] // audio_header["block_align"],
+                data_offset=audio_header["data_offset"],
+                data_size=audio_header["data_size"],
+            )
+
+    except HEADER_ERRORS:
+        pass
+    except OSError:
+        return None
+
+    # compressed, RF64, aiff, flac and so on
+    import soundfile
+
+    try:
+        return libsndfile_properties(file)
+    except soundfile.LibsndfileError:
+        return None
+
+
+def duration(file: Path) -> float | None:
+    """length of an audio file in seconds, or None if it can't be read"""
+    audio_properties = properties(file)
+    if audio_properties is None:
+        return None
+
+    return audio_properties.duration
+
+
+class PropertiesCache:
+    """
+    Audio properties of every file that has been probed, so each file is only probed once by the filter, render and report stages.
+    Files are keyed by (path, mtime, size), a file that has changed since it was probed is probed again.
+    """
+
+    def __init__(self) -> None:
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(file: Path) -> tuple:
+        stat = os.stat(file)
+        return (str(file), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, file: Path) -> AudioProperties | None:
+        """cached properties of a file, probing it if it hasn't been yet. None if it can't be read"""
+        try:
+            key = self.key(file)
+        except OSError:
+            return None
+
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+
+        audio_properties = properties(file)
+
+        with self.lock:
+            self.cache[key] = audio_properties
+
+        return audio_properties
+
+    def probe_all(self, files: list[Path], max_workers: int = PROBE_WORKERS):
+        """yield (file, properties) for every file in the order they were given, files that aren't cached are probed on a thread pool.
+        If the generator is closed early the files that haven't been probed yet are skipped.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [executor.submit(self.get, file) for file in files]
+            for file, future in zip(files, futures):
+                yield file, future.result()
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,79 @@
+from pathlib import Path
+from dataclasses import dataclass
+
+"""
+Records passed between the Worker and the render processes.
+They are kept apart from render so the GUI can use them without loading numpy, soxr and soundfile.
+"""
+
+
+# soxr's quality recipes from fastest to best, quick, low, medium, high and very high.
+RESAMPLE_QUALITIES = ("QQ", "LQ", "MQ", "HQ", "VHQ")
+DEFAULT_RESAMPLE_QUALITY = "VHQ"
+
+# subtypes a conversion can be fixed to, with the names shown for them
+TARGET_SUBTYPES = {
+    "PCM_16": "16 bit",
+    "PCM_24": "24 bit",
+    "PCM_32": "32 bit",
+    "FLOAT": "32 bit float",
+}
+
+# channel counts with a known speaker layout that variations can be mixed between, with the names shown for them
+CHANNEL_LAYOUTS = {
+    1: "Mono",
+    2: "Stereo",
+    4: "Quad",
+    6: "5.1",
+    8: "7.1",
+}
+
+
+@dataclass
+class RenderSettings:
+    """Settings shared by every variation group in a conversion"""
+
+    silence_duration: float
+    input_folder: Path
+    output_folder: Path
+    append_tag: str
+    # one of RESAMPLE_QUALITIES, used for variations that aren't at the group's samplerate
+    resample_quality: str = DEFAULT_RESAMPLE_QUALITY
+    # output format every group is converted to, None keeps the format of the group's variations
+    target_samplerate: int | None = None
+    target_subtype: str | None = None
+    target_channels: int | None = None
+    # (output channels, input channels) gains used instead of the layout's mix for variations with as many channels as it has columns
+    channel_matrix: list[list[float]] | None = None
+    # TPDF dither variations that are written at a lower bit depth than their own
+    dither: bool = False
+    # measure the peak, RMS and loudness of each output and variation while they are written
+    measure_loudness: bool = False
+    # bring each variation to this integrated loudness in LUFS before it is appended, None leaves them as they are
+    normalise_lufs: float | None = None
+
+
+class ReportObject:
+    """Result record of one variation group, returned from the render process to the Worker"""
+
+    def __init__(self, single_variation_list):
+        self.single_variation_list: list[Path] = single_variation_list
+        self.original_file_name: Path = self.single_variation_list[0]
+        self.sample_rates: list[int] = []
+        self.channels_list: list[int] = []
+        self.subtypes: list[str] = []
+        self.error = None
+        self.new_file_name_path: Path = None
+        # format of the new file
+        self.samplerate: int = None
+        self.channels: int = None
+        self.subtype: str = None
+        # length of the new file in seconds, worked out while it is written
+        self.length: float = None
+        # {"peak_dbfs", "rms_dbfs", "integrated_lufs"} of the new file and of each variation in it.
+        # left empty if loudness wasn't measured
+        self.loudness: dict = None
+        self.variation_loudness: list[dict] = []
+        # gain in dB normalising applied to each variation, None for variations too short or quiet to measure.
+        # left empty if they weren't normalised
+        self.gains_db: list[float | None] = []
@@ -0,0 +1,515 @@
+from pathlib import Path
+import os
+import signal
+import numpy
+import soundfile
+
+import utils
+import exceptions
+import probe
+import channel_layouts
+import loudness
+import resample
+from records import DEFAULT_RESAMPLE_QUALITY, ReportObject, RenderSettings
+from metadata_v2 import Metadata_Assembler
+
+"""
+Everything in this module has to stay Qt free and picklable.
+render_variation_group is sent to a ProcessPoolExecutor by the Worker, each process imports this module on its own.
+"""
+
+
+# number of frames read from a variation and written to the output at a time.
+BLOCKSIZE = 65536
+
+# added to the name of an output while it is being written, it is renamed when it is complete.
+PARTIAL_SUFFIX = ".partial"
+
+# dtypes that hold each subtype's samples without conversion, libsndfile reads and writes these bit exact.
+NATIVE_DTYPES = {
+    "PCM_U8": "int16",
+    "PCM_S8": "int16",
+    "PCM_16": "int16",
+    "PCM_24": "int32",
+    "PCM_32": "int32",
+    "FLOAT": "float32",
+    "DOUBLE": "float64",
+}
+
+# bits per sample of each subtype, for deciding when a conversion reduces the bit depth.
+# subtypes that aren't here (compressed formats) are treated as having more bits than any PCM output.
+SUBTYPE_BITS = {
+    "PCM_U8": 8,
+    "PCM_S8": 8,
+    "PCM_16": 16,
+    "PCM_24": 24,
+    "PCM_32": 32,
+    "FLOAT": 32,
+    "DOUBLE": 64,
+}
+
+# output subtypes that are dithered when they reduce the bit depth, 32 bit PCM and float outputs don't need it.
+DITHER_SUBTYPES = ("PCM_U8", "PCM_S8", "PCM_16", "PCM_24")
+
+
+def ignore_interrupts() -> None:
+    """initializer for the render processes. ctrl+c in a terminal reaches every process,
+    the parent cancels the conversion and the render processes finish the group they are on.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def output_path(
+    single_variation_list: list[Path],
+    input_folder: Path,
+    output_folder: Path,
+    append_tag: str,
+) -> Path:
+    """path the variations will be appended to"""
+    file_name_path = utils.clean_output_name(single_variation_list)
+
+    new_filename_path = utils.create_output_path(
+        file_name_path, input_folder, output_folder
+    )
+    return utils.add_end_tag_to_filename(new_filename_path, tag=append_tag)
+
+
+def partial_path(new_filename_path: Path) -> Path:
+    """temporary name an output is written under until it is complete"""
+    return new_filename_path.with_name(new_filename_path.name + PARTIAL_SUFFIX)
+
+
+def render_variation_group(
+    single_variation_list: list[Path],
+    settings: RenderSettings,
+    properties: list[probe.AudioProperties] = None,
+) -> ReportObject:
+    """Take a list of files to be appended together, create a new file from it with the metadata from the first of the old files.
+    properties are the already probed properties of each file, files without them are probed here.
+    Errors are not raised, they are stored on the returned ReportObject so the Worker can report them.
+    """
+
+    reportobj = ReportObject(single_variation_list)
+
+    try:
+        reportobj.new_file_name_path = file_append(
+            reportobj,
+            settings.silence_duration,
+            settings.input_folder,
+            settings.output_folder,
+            settings.append_tag,
+            properties=properties,
+            resample_quality=settings.resample_quality,
+            target_samplerate=settings.target_samplerate,
+            target_subtype=settings.target_subtype,
+            target_channels=settings.target_channels,
+            channel_matrix=settings.channel_matrix,
+            dither=settings.dither,
+            measure_loudness=settings.measure_loudness,
+            normalise_lufs=settings.normalise_lufs,
+        )
+
+    # if writing file error
+    except (
+        soundfile.LibsndfileError,
+        exceptions.ChannelCountError,
+        exceptions.BitDepthError,
+    ) as e:
+        # terminal out
+        print(f"{e}: file: {reportobj.original_file_name}")
+        reportobj.error = e
+
+    # if read metadata file error, file_append has already removed anything it wrote
+    except (
+        exceptions.InvalidRIFFFileException,
+        exceptions.FormatChunkError,
+        exceptions.InvalidWavFileException,
+        exceptions.EmptyFileExeption,
+        exceptions.InvalidSizeValue,
+        exceptions.SubchunkIDParsingError,
+    ) as e:
+        # terminal out
+        print(f"{e}: file: {reportobj.original_file_name}")
+        reportobj.error = e
+
+    except Exception as e:
+        # terminal out
+        print(f"Unexpected Error: {e}: file {reportobj.original_file_name}")
+        reportobj.error = e
+
+    else:
+        print("Write: ", str(reportobj.new_file_name_path))
+
+    return reportobj
+
+
+def file_append(
+    reportobj: ReportObject,
+    silence_duration: float,
+    input_folder: Path,
+    output_folder: Path,
+    append_tag: str,
+    blocksize: int = BLOCKSIZE,
+    properties: list[probe.AudioProperties] = None,
+    resample_quality: str = DEFAULT_RESAMPLE_QUALITY,
+    target_samplerate: int = None,
+    target_subtype: str = None,
+    target_channels: int = None,
+    channel_matrix: list[list[float]] = None,
+    dither: bool = False,
+    measure_loudness: bool = False,
+    normalise_lufs: float = None,
+) -> Path:
+    """
+    Take a list of one set of files with variations i.e impact_01.wav, impact_02.wav, impact_03.wav and append them together.
+    return the new file name and export the new file to its output folder.
+    The metadata from the first file in the list is written to the end of the new file in the same pass as the audio.
+
+    The output is opened once and each variation is streamed into it blocksize frames at a time,
+    so memory use depends on the block size and not on the length of the variations.
+    Variations below the highest sample rate are resampled with soxr at resample_quality, one of records.RESAMPLE_QUALITIES.
+
+    The output has the highest sample rate and channel count of the variations and their bit depth,
+    each of these can be fixed with the target arguments instead, None keeps the variations'.
+    Variations with different bit depths can only be appended with a target_subtype.
+    Variations with a different channel count are mixed to the output's with channels.mix_matrix,
+    channel_matrix replaces the layout's mix for variations with as many channels as it has columns, and sets the output's channel count.
+    With dither, variations are TPDF dithered when they are written at a lower bit depth than their own.
+
+    With measure_loudness the peak, RMS and integrated loudness of the output and each variation are measured from the blocks
+    as they are written and stored on reportobj. With normalise_lufs each variation is measured before it is written
+    and turned up or down to that loudness, as far as its peak allows, the gain is stored on reportobj whether or not it is measured.
+    """
+
+    # read the headers only, the audio is read later one block at a time.
+    if properties is None:
+        properties = [None] * len(reportobj.single_variation_list)
+
+    # files that the cache couldn't read are opened with libsndfile, so they raise its error.
+    infos = [
+        info if info is not None else probe.libsndfile_properties(file)
+        for file, info in zip(reportobj.single_variation_list, properties)
+    ]
+
+    for info in infos:
+        reportobj.sample_rates.append(info.samplerate)
+        reportobj.channels_list.append(info.channels)
+        reportobj.subtypes.append(info.subtype)
+
+    # check if files have the same sample rate and channel count, if not take the highest.
+    samplerate = target_samplerate or max(reportobj.sample_rates)
+    if target_channels:
+        channels = target_channels
+    elif channel_matrix:
+        channels = len(channel_matrix)
+    else:
+        channels = max(reportobj.channels_list)
+    subtype = target_subtype or infos[0].subtype
+
+    for info in infos:
+        if target_subtype is None and info.subtype != subtype:
+            raise exceptions.BitDepthError(
+                "Error: Variations are not of the same bit depth"
+            )
+
+    # matrices to mix each variation to the output's channel count, None for variations that are already in it.
+    # worked out before anything is written, so channel counts without a mapping fail without creating a file.
+    matrices = [
+        channel_layouts.mix_matrix(info.channels, channels, channel_matrix)
+        for info in infos
+    ]
+
+    # create the output path
+    new_filename_path = output_path(
+        reportobj.single_variation_list, input_folder, output_folder, append_tag
+    )
+
+    # check if it requires new parent folders
+    utils.create_parent_folders(new_filename_path)
+
+    # if every variation is already in the output format (the usual case), copy the samples in their native dtype.
+    # they are never decoded to float64 and encoded again, so the output is bit exact.
+    dtype = "float64"  # default dtype soundfile uses to read.
+    if (
+        all(
+            info.samplerate == samplerate
+            and info.channels == channels
+            and info.subtype == subtype
+            and matrix is None
+            for info, matrix in zip(infos, matrices)
+        )
+        and normalise_lufs is None
+    ):
+        dtype = NATIVE_DTYPES.get(subtype, dtype)
+
+    silence_frames = int(samplerate * silence_duration)
+    frames_written = 0
+
+    # only variations written at a lower bit depth than their own are dithered, the others are already on the output's steps.
+    output_dither = None
+    if dither and subtype in DITHER_SUBTYPES:
+        output_dither = Dither(SUBTYPE_BITS[subtype])
+
+    analyser = None
+    if measure_loudness:
+        analyser = loudness.Analyser(samplerate, channels)
+
+    # read the original metadata before anything is written, so files with broken metadata fail without creating a file.
+    md = Metadata_Assembler(
+        original_filename=reportobj.original_file_name, new_filename=new_filename_path
+    )
+    md.read_original()
+
+    # written under a temporary name and renamed once complete, so nothing ever sees a half written output.
+    partial = partial_path(new_filename_path)
+
+    try:
+        # libsndfile writes the header and audio through the file descriptor and patches the sizes when it closes,
+        # the metadata is then appended to the same open file.
+        with open(partial, "w+b") as out_handle:
+            with soundfile.SoundFile(
+                out_handle.fileno(),
+                "w",
+                samplerate=samplerate,
+                channels=channels,
+                subtype=subtype,
+                format="WAV",
+                closefd=False,
+            ) as out_file:
+                for i, (file, info, matrix) in enumerate(
+                    zip(reportobj.single_variation_list, infos, matrices)
+                ):
+                    # silence goes between variations, not before the first one.
+                    if i > 0:
+                        frames_written += _write_silence(
+                            out_file,
+                            silence_frames,
+                            channels,
+                            blocksize,
+                            dtype,
+                            analyser,
+                        )
+
+                    variation_dither = None
+                    if output_dither is not None and SUBTYPE_BITS.get(
+                        info.subtype, 64
+                    ) > SUBTYPE_BITS.get(subtype):
+                        variation_dither = output_dither
+
+                    mixer = None
+                    if matrix is not None:
+                        mixer = channel_layouts.ChannelMixer(matrix)
+
+                    gain = 1.0
+                    if normalise_lufs is not None:
+                        gain, gain_db = _normalise_gain(
+                            file,
+                            normalise_lufs,
+                            samplerate,
+                            channels,
+                            mixer,
+                            blocksize,
+                            resample_quality,
+                        )
+                        reportobj.gains_db.append(gain_db)
+
+                    if analyser is not None:
+                        analyser.start_variation()
+
+                    frames_written += _write_variation(
+                        out_file,
+                        file,
+                        samplerate,
+                        mixer,
+                        blocksize,
+                        dtype,
+                        resample_quality,
+                        variation_dither,
+                        gain,
+                        analyser,
+                    )
+
+                    if analyser is not None:
+                        reportobj.variation_loudness.append(analyser.end_variation())
+
+            md.splice(out_handle)
+
+        os.replace(partial, new_filename_path)
+
+    except Exception:
+        # don't leave a half written file in the output folder
+        partial.unlink(missing_ok=True)
+        raise
+
+    reportobj.samplerate = samplerate
+    reportobj.channels = channels
+    reportobj.subtype = subtype
+    reportobj.length = frames_written / samplerate
+    if analyser is not None:
+        reportobj.loudness = analyser.output.result()
+
+    return new_filename_path
+
+
+def _write_variation(
+    out_file: soundfile.SoundFile,
+    file: Path,
+    samplerate: int,
+    mixer: channel_layouts.ChannelMixer,
+    blocksize: int,
+    dtype: str = "float64",
+    resample_quality: str = DEFAULT_RESAMPLE_QUALITY,
+    dither: "Dither" = None,
+    gain: float = 1.0,
+    analyser: loudness.Analyser = None,
+) -> int:
+    """Stream one variation into the open output file, resampling, mixing channels and dithering one block at a time.
+    mixer is None for variations that are already in the output's channel count.
+    gain is applied as each block is read, analyser measures the blocks as they are written.
+    Variations are only converted on the float64 path, native dtypes are used when no conversion is needed.
+    return the number of frames written.
+    """
+    frames_written = 0
+    with soundfile.SoundFile(file, "r") as s:
+        for block in _converted_blocks(
+            s, samplerate, mixer, blocksize, dtype, resample_quality, gain
+        ):
+            if dither is not None:
+                dither.apply(block)
+            if analyser is not None:
+                analyser.add(block)
+            out_file.write(block)
+            frames_written += len(block)
+
+    return frames_written
+
+
+def _converted_blocks(
+    s: soundfile.SoundFile,
+    samplerate: int,
+    mixer: channel_layouts.ChannelMixer,
+    blocksize: int,
+    dtype: str = "float64",
+    resample_quality: str = DEFAULT_RESAMPLE_QUALITY,
+    gain: float = 1.0,
+):
+    """yield the blocks of an open variation with gain applied, resampled to samplerate and mixed to the output's channels.
+    Blocks are views into buffers that are reused, each one has to be used before the next is asked for.
+    """
+    resampler = None
+    # resample any variations that aren't at the output sample rate
+    if s.samplerate != samplerate:
+        resampler = resample.stream(
+            s.samplerate, samplerate, s.channels, "float64", resample_quality
+        )
+
+    # the same buffer is filled by every read, blocks are views into it.
+    buffer = numpy.empty((blocksize, s.channels), dtype=dtype)
+    for block in s.blocks(out=buffer):
+        if gain != 1.0:
+            block *= gain
+        if resampler is not None:
+            block = resampler.resample_chunk(block)
+        if mixer is not None:
+            block = mixer.mix(block)
+        yield block
+
+    # flush the samples the resampler is still holding on to.
+    if resampler is not None:
+        block = resampler.resample_chunk(buffer[:0], last=True)
+        if mixer is not None:
+            block = mixer.mix(block)
+        yield block
+
+
+class Dither:
+    """TPDF dither, the difference of two uniform random numbers of one step of the output bit depth each.
+    Blocks are dithered and rounded to the output's steps here, libsndfile then writes them without rounding them again,
+    some versions of it round down which would shift the dithered signal by half a step.
+    """
+
+    def __init__(self, bits: int) -> None:
+        # libsndfile scales -1.0 to 1.0 to the full integer range, one step is 1 / 2 ** (bits - 1)
+        self.steps = 2.0 ** (bits - 1)
+        self.rng = numpy.random.default_rng()
+
+    def apply(self, block: numpy.ndarray) -> None:
+        """dither and round a float block in place, clipped to the output's range so full scale samples can't wrap around"""
+        noise = self.rng.random(block.shape)
+        noise -= self.rng.random(block.shape)
+        block *= self.steps
+        block += noise
+        numpy.rint(block, out=block)
+        numpy.clip(block, -self.steps, self.steps - 1, out=block)
+        block /= self.steps
+
+
+def _normalise_gain(
+    file: Path,
+    target_lufs: float,
+    samplerate: int,
+    channels: int,
+    mixer: channel_layouts.ChannelMixer,
+    blocksize: int,
+    resample_quality: str = DEFAULT_RESAMPLE_QUALITY,
+) -> tuple[float, float | None]:
+    """(gain, gain in dB) that brings a variation to target_lufs, limited so its peak doesn't go over full scale.
+    It is measured resampled and mixed like it is written, mixing mono to stereo alone makes it 3dB louder.
+    Variations without an integrated loudness, shorter than 400ms or silent, are left as they are with a gain of 1.0 and None.
+    """
+    with soundfile.SoundFile(file, "r") as s:
+        measured = loudness.measure(
+            _converted_blocks(
+                s, samplerate, mixer, blocksize, "float64", resample_quality
+            ),
+            samplerate,
+            channels,
+        )
+
+    if measured["integrated_lufs"] is None:
+        return 1.0, None
+
+    gain_db = target_lufs - measured["integrated_lufs"]
+    gain_db = min(gain_db, -measured["peak_dbfs"])
+
+    return 10 ** (gain_db / 20), gain_db
+
+
+# read only blocks of zeros keyed by (channels, dtype), shared by every gap of silence this process writes.
+_silence_blocks = {}
+
+
+def _silence_block(frames: int, channels: int, dtype: str) -> numpy.ndarray:
+    """a read only block of at least frames zeros, made once per channel count and dtype and then reused"""
+    block = _silence_blocks.get((channels, dtype))
+    if block is None or len(block) < frames:
+        block = numpy.zeros((frames, channels), dtype=dtype)
+        block.flags.writeable = False
+        _silence_blocks[(channels, dtype)] = block
+
+    return block
+
+
+def _write_silence(
+    out_file: soundfile.SoundFile,
+    frames: int,
+    channels: int,
+    blocksize: int,
+    dtype: str = "float64",
+    analyser: loudness.Analyser = None,
+) -> int:
+    """Write frames of silence to the open output file from one shared block of zeros,
+    so any length of silence costs one block of memory per process. return the number of frames written.
+    wav data can't be sparse, libsndfile only writes forward, so the zeros are written out.
+    """
+    frames_written = frames
+    silence_block = _silence_block(min(frames, blocksize), channels, dtype)
+    if analyser is not None:
+        analyser.add_silence(frames)
+
+    while frames > 0:
+        write_frames = min(frames, blocksize)
+        out_file.write(silence_block[:write_frames])
+        frames -= write_frames
+
+    return frames_written
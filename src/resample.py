@@ -0,0 +1,38 @@
+import soxr
+
+from records import RESAMPLE_QUALITIES
+
+"""
+Qt free resampler cache. Each render process keeps the soxr streams it has made and clears them for the next variation
+with the same conversion, instead of designing the same filters again for every variation.
+"""
+
+
+# (input samplerate, output samplerate, channels, dtype, quality) -> soxr.ResampleStream
+_streams = {}
+
+
+def stream(
+    in_rate: int, out_rate: int, channels: int, dtype: str, quality: str
+) -> soxr.ResampleStream:
+    """a resample stream ready for a new signal.
+    Render processes append one group at a time, so a stream is only ever used by one variation at once.
+    """
+    if quality not in RESAMPLE_QUALITIES:
+        raise ValueError(f"unknown resample quality: {quality}")
+
+    key = (in_rate, out_rate, channels, dtype, quality)
+    resampler = _streams.get(key)
+    if resampler is None:
+        resampler = soxr.ResampleStream(
+            in_rate, out_rate, channels, dtype=dtype, quality=quality
+        )
+        _streams[key] = resampler
+    else:
+        resampler.clear()
+
+    return resampler
+
+
+def clear_cache() -> None:
+    _streams.clear()
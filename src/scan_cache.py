@@ -0,0 +1,107 @@
+from pathlib import Path
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# listings of directories modified this recently aren't stored. Network drives and FAT store times in ticks of up to 2 seconds,
+# so something else could still change in a directory without its modification time changing, git's index calls this racily clean.
+RACY_SECONDS = 2
+
+
+def default_cache_path() -> Path:
+    """The scan cache lives in the same appdata folder as the reports"""
+    appname = "SausageFileConverter"
+    appauthor = "SoundSpruce"
+
+    import platformdirs
+
+    path = platformdirs.user_data_path(appname, appauthor, ensure_exists=False)
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+    return Path(path) / "scan_cache.sqlite3"
+
+
+class ScanCache:
+    """
+    On disk index of directory listings that lasts between sessions.
+    A directory's modification time changes whenever something is added, removed or renamed in it,
+    so a listing is only valid while the directory still has the modification time it was stored with.
+    Folders that are removed are dropped from the index as the folder they were in is listed again, so it doesn't keep growing.
+    """
+
+    def __init__(self, db_path) -> None:
+        self.db_path = db_path
+        # one connection is shared by every thread that scans, the lock keeps it to one user at a time.
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS directories (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    entries TEXT NOT NULL
+                )""")
+            self.connection.commit()
+
+    def get(self, directory: Path, mtime_ns: int) -> list | None:
+        """return [[name, is_dir], ...] for the directory, or None if it isn't cached or has changed since"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mtime_ns, entries FROM directories WHERE path = ?",
+                (str(directory),),
+            ).fetchone()
+
+        if row is None or row[0] != mtime_ns:
+            return None
+
+        return json.loads(row[1])
+
+    def put(self, directory: Path, mtime_ns: int, entries: list) -> None:
+        """store the listing of a directory, [[name, is_dir], ...], unless it was modified too recently to be sure it's complete.
+        Sub folders the directory's last stored listing had and this one doesn't are removed from the index.
+        """
+        folders = {name for name, is_dir in entries if is_dir}
+        racy = time.time_ns() - mtime_ns < RACY_SECONDS * 1_000_000_000
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT entries FROM directories WHERE path = ?", (str(directory),)
+            ).fetchone()
+            if row is not None:
+                for name, is_dir in json.loads(row[0]):
+                    if is_dir and name not in folders:
+                        self._remove_tree(Path(directory) / name)
+
+            if racy:
+                self.connection.execute(
+                    "DELETE FROM directories WHERE path = ?", (str(directory),)
+                )
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO directories (path, mtime_ns, entries) VALUES (?, ?, ?)",
+                    (str(directory), mtime_ns, json.dumps(entries)),
+                )
+
+    def remove(self, directory: Path) -> None:
+        """forget a directory that no longer exists and every folder in it"""
+        with self.lock:
+            self._remove_tree(directory)
+
+    def _remove_tree(self, directory: Path) -> None:
+        # the directory and everything whose path starts with it and a separator
+        prefix = os.path.join(str(directory), "")
+        self.connection.execute(
+            "DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?",
+            (str(directory), len(prefix), prefix),
+        )
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
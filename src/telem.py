@@ -1,4 +1,3 @@
-import requests
 import uuid
 from PySide6 import QtCore
 import datetime
@@ -20,6 +19,9 @@ class SendThread(QtCore.QThread):
         headers = {"Host": "soundspruce.com"}
 
         try:
+            # requests is slow to import, so it is loaded here in the send thread rather than at startup.
+            import requests
+
             requests.post(DATABASE_URL, json=self.payload, timeout=30, headers=headers)
         except Exception as e:
             self.has_internet.emit(False)
@@ -41,7 +43,10 @@ class Telem(QtCore.QObject):
         self.session_end = datetime.datetime.now().isoformat()
 
         self.internet_status = True
-        # method calls
+
+    @QtCore.Slot()
+    def start(self):
+        """called once the main window has been painted, so the first request never holds up startup."""
         self._send_first_request()
 
     def _send_first_request(self):
@@ -83,6 +88,8 @@ class Telem(QtCore.QObject):
             return None
             # this also returns None if the server isn't running.
 
+        import requests
+
         pl = self._get_json_payload()
         headers = {"Host": "soundspruce.com"}
         r = requests.post(DATABASE_URL, json=pl, timeout=15, headers=headers)
@@ -1,15 +1,39 @@
 from pathlib import Path
+import concurrent.futures
+import functools
+import os
 import re
+import sys
 import natsort
 
+# number of folders listed at the same time while scanning, scanning waits on the disk or network more than the cpu.
+SCAN_WORKERS = 16
+# loudness in LUFS variations can be normalised to, from the -70 LUFS gate up to full scale
+MIN_NORMALISE_LUFS = -70.0
+MAX_NORMALISE_LUFS = 0.0
 
-def get_files(in_folder_path: Path) -> tuple[list, list]:
-    """Get files with audio file suffixes from folder directory"""
+
+def get_files(in_folder_path: Path, cache=None) -> tuple[list, list]:
+    """Get files with audio file suffixes from folder directory.
+    If a ScanCache is given, directories that haven't changed since the last scan are listed from the cache.
+    """
+    audio_file_names, non_audio_file_names = split_audio_files(
+        walk_directory(in_folder_path, cache)
+    )
+
+    audio_file_names = natsort.natsorted(audio_file_names)
+
+    if cache is not None:
+        cache.commit()
+
+    return (audio_file_names, non_audio_file_names)
+
+
+def split_audio_files(file_paths) -> tuple[list, list]:
+    """Split paths into audio files and everything else by their name, the lists are in the order they were given"""
     audio_file_names = []
     non_audio_file_names = []
 
-    file_paths = in_folder_path.rglob("*")  # .iterdir() - only one folder
-
     # wav only for now, change == types to 'in types'
     """ types = (
         ".wav",
@@ -36,12 +60,162 @@ def get_files(in_folder_path: Path) -> tuple[list, list]:
         else:
             non_audio_file_names.append(file)
 
-    audio_file_names = natsort.natsorted(audio_file_names)
-
     return (audio_file_names, non_audio_file_names)
 
 
-def split_paths_to_tokens(file_names: list[Path]) -> dict[Path:list]:
+def list_directory(directory: Path, cache=None) -> list:
+    """return [[name, is_dir], ...] for everything in a directory, from the cache if the directory hasn't changed"""
+    try:
+        if cache is not None:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            entries = cache.get(directory, mtime_ns)
+            if entries is not None:
+                return entries
+
+        # DirEntry knows if it's a folder from the listing itself, so there's no stat call per file.
+        # symlinked folders are listed but not walked into, the same as rglob
+        with os.scandir(directory) as scanned:
+            entries = [
+                [entry.name, entry.is_dir(follow_symlinks=False)] for entry in scanned
+            ]
+
+    # removed or replaced with a file, since it was found or since the last scan
+    except (FileNotFoundError, NotADirectoryError):
+        if cache is not None:
+            cache.remove(directory)
+        return []
+
+    # rglob skips folders it isn't allowed to read
+    except OSError:
+        return []
+
+    if cache is not None:
+        cache.put(directory, mtime_ns, entries)
+
+    return entries
+
+
+def walk_directory_batches(in_folder_path: Path, cache=None, max_workers=SCAN_WORKERS):
+    """yield (folder, [paths in the folder]) for every folder below and including in_folder_path as soon as it has been listed.
+    Folders are listed on a thread pool so the latency of network drives overlaps, the order of the folders isn't fixed.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as t_executor:
+        pending = {
+            t_executor.submit(list_directory, in_folder_path, cache): in_folder_path
+        }
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                directory = pending.pop(future)
+
+                paths = []
+                for name, is_dir in future.result():
+                    path = directory / name
+                    if is_dir:
+                        pending[t_executor.submit(list_directory, path, cache)] = path
+                    paths.append(path)
+
+                yield directory, paths
+
+
+def walk_directory(in_folder_path: Path, cache=None, max_workers=SCAN_WORKERS):
+    """yield the path of every file and folder below in_folder_path, like rglob("*")"""
+    for directory, paths in walk_directory_batches(in_folder_path, cache, max_workers):
+        yield from paths
+
+
+class Tokenizer:
+    """Split file names into words and numbers, the same tokenizer is shared by scanning, grouping and output naming.
+    The pattern is compiled once and names are memoised, so a name that is tokenized again (i.e when the output name is made) is free.
+    Tokens are tuples of interned strings, so millions of paths share one copy of each word instead of carrying their own lists.
+    """
+
+    """This regex will match all digits with a distance after it i.e cm/m/ft.
+    One problem is any names that have a number followed by a word with cm/m/ft will also be caught in it
+    so 12monty will be '12m' 'onty' and 13monty would be '13m' 'onty' and not be counted as variations.
+    This may cause a few errors but is a wider edge case than file names with distances in them.
+    """
+    digit_and_distancechars = r"(?:\d+(?:ft|FT|Ft|m|M|cm|CM|Cm)(?=\b|\s|_|-))"
+    all_chars = r"[a-zA-Z]+"
+    all_digits = r"\d+"
+
+    def __init__(self, maxsize: int = 2**20) -> None:
+        self.pattern = re.compile(
+            rf"{self.digit_and_distancechars}|{self.all_chars}|{self.all_digits}"
+        )
+        self.tokenize = functools.lru_cache(maxsize=maxsize)(self._tokenize)
+
+    def _tokenize(self, name: str) -> tuple[str, ...]:
+        return tuple(sys.intern(token) for token in self.pattern.findall(name))
+
+
+tokenizer = Tokenizer()
+
+
+def exclusion_str_to_list(text: str) -> list[str]:
+    """split comma separated exclusion keywords, a trailing , causes split to an empty string, so remove it."""
+    return [item.strip() for item in text.split(",") if item.strip() != ""]
+
+
+def parse_channel_matrix(text: str) -> list[list[float]]:
+    """a matrix written as rows separated with ; and gains with , one row per output channel and one gain per input channel.
+    "1,0,0.7;0,1,0.7" mixes three channels to two. raises ValueError if it isn't a matrix.
+    """
+    rows = [
+        [float(gain) for gain in row.split(",")]
+        for row in text.split(";")
+        if row.strip()
+    ]
+    if not rows:
+        raise ValueError(f"no rows: {text}")
+    if any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError(f"rows of different lengths: {text}")
+
+    return rows
+
+
+def parse_normalise_lufs(text: str) -> float | None:
+    """the loudness to normalise variations to, from the GUI's field or the --normalise argument. Empty is off and returns None.
+    raises ValueError if it isn't a number from MIN_NORMALISE_LUFS up to, but not including, MAX_NORMALISE_LUFS.
+    """
+    text = text.strip()
+    if not text:
+        return None
+
+    try:
+        value = float(text)
+    except ValueError:
+        value = None
+    # nan fails the comparison too
+    if value is None or not MIN_NORMALISE_LUFS <= value < MAX_NORMALISE_LUFS:
+        raise ValueError(
+            f"{text} is not between {MIN_NORMALISE_LUFS:g} and {MAX_NORMALISE_LUFS:g} LUFS"
+        )
+
+    return value
+
+
+def remove_files_with_exclude(
+    file_names: list[Path], keywords: list[str], root: Path
+) -> list[Path]:
+    """the same rule as the tree view's filter, a file is removed if any keyword is in its name or the name of a folder between it and root."""
+    if not keywords:
+        return list(file_names)
+
+    filtered = []
+    for file in file_names:
+        parts = file.relative_to(root).parts
+        if not any(keyword in part for keyword in keywords for part in parts):
+            filtered.append(file)
+
+    return filtered
+
+
+def split_paths_to_tokens(file_names: list[Path]) -> dict[Path:tuple]:
     """Split file name into individual words and remove digits, punctuation etc"""
     path_and_tokens = {}  # path and tokens value with numbers removed
 
@@ -54,22 +228,7 @@ def split_paths_to_tokens(file_names: list[Path]) -> dict[Path:list]:
         if file_path.is_dir():
             continue"""
 
-        name = file_path.stem
-
-        """This regex will match all digits with a distance after it i.e cm/m/ft.
-        One problem is any names that have a number followed by a word with cm/m/ft will also be caught in it
-        so 12monty will be '12m' 'onty' and 13monty would be '13m' 'onty' and not be counted as variations.
-        This may cause a few errors but is a wider edge case than file names with distances in them.
-        """
-        digit_and_distancechars = r"(?:\d+(?:ft|FT|Ft|m|M|cm|CM|Cm)(?=\b|\s|_|-))"
-        all_chars = r"[a-zA-Z]+"
-        all_digits = r"\d+"
-
-        tokens = re.findall(
-            rf"{digit_and_distancechars}|{all_chars}|{all_digits}", name
-        )
-
-        path_and_tokens[file_path] = tokens
+        path_and_tokens[file_path] = tokenizer.tokenize(file_path.stem)
 
     return path_and_tokens
 
@@ -78,7 +237,7 @@ def split_paths_to_tokens(file_names: list[Path]) -> dict[Path:list]:
 
 
 def difference_token_index(
-    file_pair1: list[Path, list[str]], file_pair2: list[Path, list[str]]
+    file_pair1: list[Path, tuple[str]], file_pair2: list[Path, tuple[str]]
 ) -> int:
     """File path and tokens pair.  See if word tokens in file 1 match those in file 2
     return -1 if there isn't a difference index or the words do not match"""
@@ -155,6 +314,47 @@ def find_files_with_variations(path_and_tokens_by_name: dict) -> list[list]:
     return files_with_variations
 
 
+def group_files_by_variation(path_and_tokens_by_name: dict) -> list[list]:
+    """
+    Find which files have variations and return the file paths in a list of lists, in one pass with a dict.
+    Unlike find_files_with_variations, variations don't have to be next to each other in the sorted list to be found.
+
+    Every digit token in a file name gives the file a key:
+    (parent folder, index of the digit, tokens before the digit, tokens after the digit)
+    Files with the same key only differ by that number, so they are variations of each other.
+    Files with the same number as well only differ by their separators, i.e foo_01 and foo-01, only the first of them is a variation.
+    A file with more than one number, i.e andrewscott_01_02, goes in the group of its right most number that has variations,
+    the variation number is nearly always the last number in a name.
+    """
+    # key -> {number: first file with that number}
+    files_by_key = {}
+    keys_by_file = []
+
+    for file_path, tokens in path_and_tokens_by_name.items():
+        # the folder as a string, hashing a new Path object for every key is a lot slower
+        parent = os.path.dirname(file_path)
+        tokens = tuple(tokens)
+        keys = []
+        for i, token in enumerate(tokens):
+            if token.isdigit():
+                key = (parent, i, tokens[:i], tokens[i + 1 :])
+                files_by_key.setdefault(key, {}).setdefault(token, file_path)
+                keys.append((key, token))
+
+        keys_by_file.append((file_path, keys))
+
+    # groups are in the order of their first file, files keep the order they were given in
+    groups = {}
+    for file_path, keys in keys_by_file:
+        for key, token in reversed(keys):
+            numbers = files_by_key[key]
+            if len(numbers) > 1 and numbers[token] is file_path:
+                groups.setdefault(key, []).append(file_path)
+                break
+
+    return [files for files in groups.values() if len(files) > 1]
+
+
 # files to copy
 
 
@@ -163,18 +363,59 @@ def find_files_without_variations(
 ):
     """Find files without variations by taking list of list of correct_duration_list and comparing them with original file list."""
 
-    files_without_vars = []
-    files_with_vars = []  # flat list
-
-    # flatten files_with_variations
+    # set of files with variations, so checking a file is O(1)
+    files_with_vars = set()
     for files in correct_duration_list:
-        files_with_vars.extend(files)
+        files_with_vars.update(files)
 
-    for file in file_names:
-        if file not in files_with_vars:
-            files_without_vars.append(file)
+    return [file for file in file_names if file not in files_with_vars]
 
-    return files_without_vars
+
+def plan_copy_jobs(
+    files_to_copy: list[Path],
+    correct_duration_list: list[list[Path]],
+    input_folder: Path,
+) -> list[Path]:
+    """
+    Turn the list of files and folders to copy into as few copy jobs as possible.
+    A folder that doesn't have variations anywhere inside it is copied whole with one copytree,
+    anything inside it is left out of the plan. Files in folders that do have variations are still copied one by one.
+    """
+    # every folder above a file with variations has to be copied file by file
+    folders_with_variations = set()
+    for files in correct_duration_list:
+        for file in files:
+            for parent in file.parents:
+                if parent in folders_with_variations:
+                    break
+                folders_with_variations.add(parent)
+
+    # folder -> highest folder above it (or itself) that can be copied whole, None if there isn't one
+    top_folders = {}
+
+    def top_folder(folder: Path):
+        if folder not in top_folders:
+            if folder == input_folder or folder in folders_with_variations:
+                top_folders[folder] = None
+            else:
+                top_folders[folder] = top_folder(folder.parent) or folder
+
+        return top_folders[folder]
+
+    copy_jobs = []
+    planned = set()
+    for path in files_to_copy:
+        # the files in these are copied one by one, so the folder itself isn't a job
+        if path in folders_with_variations:
+            continue
+
+        job = top_folder(path.parent) or path
+
+        if job not in planned:
+            planned.add(job)
+            copy_jobs.append(job)
+
+    return copy_jobs
 
 
 def create_output_path(
@@ -0,0 +1,250 @@
+from pathlib import Path
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from src import utils
+from src import pipeline
+from src import journal
+
+
+def run_cli(*args):
+    return subprocess.run(
+        [sys.executable, "src/cli.py", *[str(a) for a in args]],
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_cli_does_not_import_qt():
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; sys.path.insert(0, 'src'); import cli; print('PySide6' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert out.stdout.strip() == "False"
+
+
+def test_gui_does_not_import_audio_modules_on_start():
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; sys.path.insert(0, 'src'); import mainwindow; "
+            "print(sorted(m for m in ('numpy', 'soundfile', 'soxr', 'mdutils', 'requests', 'render') if m in sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert out.stdout.strip() == "[]"
+
+
+def test_render_processes_do_not_import_qt():
+    # spawned render processes run app.py as __mp_main__
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, runpy; sys.path.insert(0, 'src'); runpy.run_path('src/app.py', run_name='__mp_main__'); "
+            "print(sorted(m for m in ('PySide6', 'mainwindow') if m in sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert out.stdout.strip() == "[]"
+
+
+def test_cli_converts_with_json_progress(tmp_path):
+    in_folder = tmp_path / "in"
+    shutil.copytree("tests/files/diffsamplerate", in_folder / "diffsamplerate")
+    # variations that can't be read, so they fail and are copied instead
+    shutil.copytree("tests/files/notaudio", in_folder / "notaudio")
+    (in_folder / "readme.txt").write_text("not audio")
+
+    out = run_cli(
+        in_folder,
+        "-o",
+        tmp_path / "out",
+        "--copy",
+        "--jobs",
+        "1",
+        "--json",
+        "--loudness",
+        "--report-dir",
+        tmp_path / "reports",
+    )
+
+    # stdout is only json
+    events = [json.loads(line) for line in out.stdout.splitlines()]
+    finished = events[-1]
+
+    assert out.returncode == 1
+    assert finished["event"] == "finished"
+    assert finished["exit_code"] == 1
+    assert finished["files_created"] == 1
+    assert finished["failures"] == 1
+    assert Path(finished["report"]).exists()
+
+    loudness_report = json.loads(Path(finished["loudness_report"]).read_text())
+    (output,) = loudness_report["outputs"]
+    assert output["output"].endswith("test_file.wav")
+    assert len(output["variations"]) == 3
+    assert output["integrated_lufs"] is not None
+
+    assert (tmp_path / "out" / "diffsamplerate" / "test_file.wav").exists()
+    assert (tmp_path / "out" / "notaudio" / "notaudiofile_1.wav").exists()
+    assert (tmp_path / "out" / "readme.txt").exists()
+
+    stages = [e["stage"] for e in events if e["event"] == "stage"]
+    assert stages == ["Appending...", "Copying..."]
+
+
+def run_pipeline(p, in_folder, out_folder, reports):
+    reports.mkdir()
+    p.report_path = reports
+
+    audio_files, non_audio_files = utils.get_files(in_folder)
+    p.all_inputs(
+        str(in_folder),
+        str(out_folder),
+        0.5,
+        0,
+        False,
+        audio_files,
+        "",
+        audio_files,
+        non_audio_files,
+    )
+
+
+def test_cli_reports_normalise_gains_without_measuring(tmp_path):
+    out = run_cli(
+        "tests/files/diffsamplerate",
+        "-o",
+        tmp_path / "out",
+        "--normalise",
+        "-30",
+        "--json",
+        "--report-dir",
+        tmp_path / "reports",
+    )
+    finished = json.loads(out.stdout.splitlines()[-1])
+
+    assert "Gain: " in Path(finished["report"]).read_text()
+    (output,) = json.loads(Path(finished["loudness_report"]).read_text())["outputs"]
+    assert "integrated_lufs" not in output
+    assert len(output["variations"]) == 3
+    assert all("gain_db" in variation for variation in output["variations"])
+
+
+def test_cancelled_before_appending_renders_nothing(tmp_path):
+    in_folder = tmp_path / "in"
+    shutil.copytree("tests/files/diffsamplerate", in_folder / "diffsamplerate")
+
+    p = pipeline.Pipeline({"break": True}, max_workers=1)
+    run_pipeline(p, in_folder, tmp_path / "out", tmp_path / "reports")
+
+    assert len(p.cancelled_groups) == 1
+    assert p.ctrl["files_created"] == 0
+    # nothing was written, not even the manifest or journal
+    assert not (tmp_path / "out").exists()
+
+
+def test_partial_outputs_of_a_killed_run_are_removed(tmp_path):
+    in_folder = tmp_path / "in"
+    shutil.copytree("tests/files/diffsamplerate", in_folder / "diffsamplerate")
+    out_folder = tmp_path / "out"
+
+    # a run that was killed while rendering other/metal.wav
+    killed = journal.Journal(out_folder)
+    killed.open()
+    killed.pending("other/metal.wav", [in_folder / "other" / "metal_01.wav"])
+    killed.close()
+    (out_folder / "other").mkdir()
+    partial = out_folder / "other" / "metal.wav.partial"
+    partial.write_bytes(b"RIFF")
+
+    p = pipeline.Pipeline({"break": False}, max_workers=1)
+    run_pipeline(p, in_folder, out_folder, tmp_path / "reports")
+
+    assert not partial.exists()
+    assert p.ctrl["files_created"] == 1
+
+
+def kill_render_process():
+    os._exit(1)
+
+
+def test_render_process_dying_fails_its_groups(tmp_path, monkeypatch):
+    in_folder = tmp_path / "in"
+    shutil.copytree("tests/files/diffsamplerate", in_folder / "diffsamplerate")
+    shutil.copytree("tests/files/diffchannels", in_folder / "diffchannels")
+
+    # the render processes run this when they start, so they die before rendering anything
+    monkeypatch.setattr("render.ignore_interrupts", kill_render_process)
+
+    logs = []
+    p = pipeline.Pipeline({"break": False}, max_workers=1)
+    p.logger.connect(lambda *args: logs.append(args))
+    run_pipeline(p, in_folder, tmp_path / "out", tmp_path / "reports")
+
+    assert len(p.errored_files) == 2
+    assert [success for function, success, _, _ in logs if function == "Write"] == [
+        False,
+        False,
+    ]
+    assert "Files that caused Errors" in Path(f"{p.report.file_name}.md").read_text()
+
+
+def test_cli_usage_error(tmp_path):
+    out = run_cli(tmp_path / "missing")
+    assert out.returncode == 2
+
+
+def test_remove_files_with_exclude():
+    root = Path("/library")
+    files = [
+        root / "impacts" / "metal_01.wav",
+        root / "impacts" / "wood_01.wav",
+        root / "old impacts" / "metal_02.wav",
+    ]
+
+    keywords = utils.exclusion_str_to_list(" wood, old ,")
+    assert keywords == ["wood", "old"]
+
+    assert utils.remove_files_with_exclude(files, keywords, root) == [
+        root / "impacts" / "metal_01.wav"
+    ]
+
+
+def test_parse_channel_matrix():
+    assert utils.parse_channel_matrix("1,0,0.7; 0,1,0.7;") == [
+        [1.0, 0.0, 0.7],
+        [0.0, 1.0, 0.7],
+    ]
+
+    for text in ("", "1,0;1", "1,a"):
+        with pytest.raises(ValueError):
+            utils.parse_channel_matrix(text)
+
+
+def test_parse_normalise_lufs():
+    assert utils.parse_normalise_lufs("") is None
+    assert utils.parse_normalise_lufs(" -23 ") == -23.0
+    assert utils.parse_normalise_lufs("-70") == -70.0
+
+    for text in ("0", "3", "-70.1", "-", "nan", "loud"):
+        with pytest.raises(ValueError):
+            utils.parse_normalise_lufs(text)
+
+    out = run_cli("tests/files", "--normalise", "0")
+    assert out.returncode == 2
+    assert "not between -70 and 0 LUFS" in out.stderr
@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from src import file_tree
+
+
+def get_rows(model, parent_index):
+    """names of the children of parent_index"""
+    return [
+        model.index(row, 0, parent_index).internalPointer().data().name
+        for row in range(model.rowCount(parent_index))
+    ]
+
+
+def test_insert_files_in_batches():
+    root = Path("A:/library")
+    model = file_tree.TreeModel([], root)
+
+    inserted = []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append(first))
+
+    # batches arrive in the order folders finish scanning, not in name order
+    model.insertFiles([root / "impacts/metal_10.wav", root / "impacts/metal_2.wav"])
+    model.insertFiles([root / "ambience/wind_1.wav", root / "ambience/wind_2.wav"])
+    model.insertFiles(
+        [root / "impacts/deep/wood_1.wav", root / "impacts/deep/wood_2.wav"]
+    )
+
+    root_index = file_tree.QtCore.QModelIndex()
+    assert get_rows(model, root_index) == ["ambience", "impacts"]
+
+    impacts_index = model.index(1, 0, root_index)
+    assert get_rows(model, impacts_index) == ["deep", "metal_2.wav", "metal_10.wav"]
+
+    deep_index = model.index(0, 0, impacts_index)
+    assert get_rows(model, deep_index) == ["wood_1.wav", "wood_2.wav"]
+    assert model.parent(deep_index) == impacts_index
+
+    # one row inserted per folder and file
+    assert len(inserted) == 9
+
+
+if __name__ == "__main__":
+    pass
@@ -1,7 +1,13 @@
 from pathlib import Path
+import errno
+import os
+import threading
+import time
 
 from src import utils
 from src import worker
+from src import scan_cache
+from src import copier
 from pprint import pprint
 
 
@@ -48,27 +54,136 @@ def test_get_files_folders_in_folders_true(tmp_path):
     ]
 
 
+def test_get_files_finds_the_same_paths_as_rglob(tmp_path):
+    create_temp(tmp_path)
+    (tmp_path / "._abc_01.wav").touch()
+
+    audio_files, non_audio_files = utils.get_files(tmp_path)
+
+    assert sorted(audio_files + non_audio_files) == sorted(tmp_path.rglob("*"))
+    assert tmp_path / "mydir" / "empty" in non_audio_files
+    assert tmp_path / "._abc_01.wav" in non_audio_files
+
+
+def age_folders(root):
+    """set the modification time of every folder to long ago, folders modified in the last few seconds aren't cached"""
+    for folder in [root, *(p for p in root.rglob("*") if p.is_dir())]:
+        os.utime(folder, ns=(1_000_000_000 * 10**9, 1_000_000_000 * 10**9))
+
+
+def test_get_files_with_scan_cache(tmp_path):
+    create_temp(tmp_path / "library")
+    library = tmp_path / "library"
+    age_folders(library)
+    cache = scan_cache.ScanCache(tmp_path / "cache.sqlite3")
+
+    uncached = utils.get_files(library)
+    assert utils.get_files(library, cache=cache) == uncached
+
+    # unchanged folders are listed from the cache, not the disk
+    cache.put(library, library.stat().st_mtime_ns, [["cached_01.wav", False]])
+    audio_files, non_audio_files = utils.get_files(library, cache=cache)
+    assert audio_files == [library / "cached_01.wav"]
+
+    # a folder that has changed is listed again
+    (library / "new_01.wav").touch()
+    audio_files, non_audio_files = utils.get_files(library, cache=cache)
+    assert library / "new_01.wav" in audio_files
+    assert library / "cached_01.wav" not in audio_files
+    assert library / "mydir" / "01monty.wav" in audio_files
+
+    cache.close()
+
+
+def test_get_files_skips_folders_removed_during_the_scan(tmp_path):
+    library = tmp_path / "library"
+    library.mkdir()
+    (library / "abc_01.wav").touch()
+    (library / "replaced").touch()
+    age_folders(library)
+    cache = scan_cache.ScanCache(tmp_path / "cache.sqlite3")
+
+    # listed as folders, but one was removed and one was replaced with a file by the time they are walked into
+    cache.put(
+        library,
+        library.stat().st_mtime_ns,
+        [["abc_01.wav", False], ["removed", True], ["replaced", True]],
+    )
+    audio_files, non_audio_files = utils.get_files(library, cache=cache)
+
+    assert audio_files == [library / "abc_01.wav"]
+    assert utils.list_directory(library / "removed") == []
+    assert utils.list_directory(library / "replaced") == []
+
+    cache.close()
+
+
+def test_scan_cache_skips_racy_listings_and_forgets_removed_folders(tmp_path):
+    library = tmp_path / "library"
+    (library / "kept" / "inner").mkdir(parents=True)
+    (library / "removed" / "inner").mkdir(parents=True)
+    (library / "removed_too").mkdir()
+    cache = scan_cache.ScanCache(tmp_path / "cache.sqlite3")
+
+    def cached(folder):
+        return cache.get(folder, folder.stat().st_mtime_ns)
+
+    # just modified, something could still change in the same tick of the modification time
+    utils.get_files(library, cache=cache)
+    assert cached(library) is None
+
+    age_folders(library)
+    utils.get_files(library, cache=cache)
+    assert cached(library) is not None
+    assert cached(library / "removed" / "inner") == []
+
+    def rows():
+        return {
+            Path(row[0])
+            for row in cache.connection.execute("SELECT path FROM directories")
+        }
+
+    # a folder removed from a folder that is listed again is dropped with everything in it
+    (library / "removed" / "inner").rmdir()
+    (library / "removed").rmdir()
+    age_folders(library)
+    utils.get_files(library, cache=cache)
+    assert rows() == {
+        library,
+        library / "kept",
+        library / "kept" / "inner",
+        library / "removed_too",
+    }
+
+    # a folder that can't be found any more
+    (library / "removed_too").rmdir()
+    utils.list_directory(library / "removed_too", cache=cache)
+    assert library / "removed_too" not in rows()
+
+    cache.close()
+
+
 def test_file_tokenization(tmp_path):
     create_temp(tmp_path)
     audio_files, non_audio_files = utils.get_files(tmp_path)
     tokens = utils.split_paths_to_tokens(audio_files)
     assert tokens == {
-        Path(f"{tmp_path}/abc_01.wav"): [
+        Path(f"{tmp_path}/abc_01.wav"): (
             "abc",
             "01",
-        ],
-        Path(f"{tmp_path}/abc_02.wav"): [
+        ),
+        Path(f"{tmp_path}/abc_02.wav"): (
             "abc",
             "02",
-        ],
-        Path(f"{tmp_path}/abc_3.wav"): ["abc", "3"],
-        Path(f"{tmp_path}/abc_5.wav"): ["abc", "5"],
-        Path(f"{tmp_path}/abc_11.wav"): ["abc", "11"],
+        ),
+        Path(f"{tmp_path}/abc_3.wav"): ("abc", "3"),
+        Path(f"{tmp_path}/abc_5.wav"): ("abc", "5"),
+        Path(f"{tmp_path}/abc_11.wav"): ("abc", "11"),
         # new regex breaks this, but it's less likely to have a variation like that than a distance.
-        Path(f"{tmp_path}/mydir/01monty.wav"): ["01", "monty"],
-        Path(f"{tmp_path}/mydir/02monty.wav"): ["02", "monty"],
-        Path(f"{tmp_path}/mydir/monty_1m_01.wav"): ["monty", "1m", "01"],
-        Path(f"{tmp_path}/mydir/monty_1m_02.wav"): ["monty", "1m", "02"],
+        Path(f"{tmp_path}/mydir/01monty.wav"): ("01", "monty"),
+        Path(f"{tmp_path}/mydir/02monty.wav"): ("02", "monty"),
+        Path(f"{tmp_path}/mydir/monty_1m_01.wav"): ("monty", "1m", "01"),
+        Path(f"{tmp_path}/mydir/monty_1m_02.wav"): ("monty", "1m", "02"),
     }
 
     # distance tokens
@@ -80,12 +195,19 @@ def test_file_tokenization(tmp_path):
     }
     tokens = utils.split_paths_to_tokens(data3)
     assert tokens == {
-        Path("A:/made_up/gunshot 5m 1"): ["gunshot", "5m", "1"],
-        Path("A:/made_up/gunshot 5m 2"): ["gunshot", "5m", "2"],
-        Path("A:/made_up/gunshot 10m 1"): ["gunshot", "10m", "1"],
-        Path("A:/made_up/gunshot 10m 2"): ["gunshot", "10m", "2"],
+        Path("A:/made_up/gunshot 5m 1"): ("gunshot", "5m", "1"),
+        Path("A:/made_up/gunshot 5m 2"): ("gunshot", "5m", "2"),
+        Path("A:/made_up/gunshot 10m 1"): ("gunshot", "10m", "1"),
+        Path("A:/made_up/gunshot 10m 2"): ("gunshot", "10m", "2"),
     }
 
+    # names are memoised and tokens are shared between paths
+    again = utils.split_paths_to_tokens([Path("B:/other_folder/gunshot 5m 1")])
+    assert (
+        again[Path("B:/other_folder/gunshot 5m 1")]
+        is tokens[Path("A:/made_up/gunshot 5m 1")]
+    )
+
 
 def test_files_with_variations():
     data = {
@@ -264,6 +386,62 @@ def test_files_with_variations():
     assert output3 == expected_output
 
 
+def test_group_files_by_variation(tmp_path):
+    # gives the same groups as find_files_with_variations when variations are next to each other
+    create_temp(tmp_path)
+    audio_files, non_audio_files = utils.get_files(tmp_path)
+    tokens = utils.split_paths_to_tokens(audio_files)
+
+    assert utils.group_files_by_variation(tokens) == (
+        utils.find_files_with_variations(tokens)
+    )
+
+    data = {
+        Path("D:/andrewscott_01_1.wav"): ["andrewscott", "01", "1"],
+        Path("D:/andrewscott_01_2.wav"): ["andrewscott", "01", "2"],
+        Path("D:/andrewscott_01_3.wav"): ["andrewscott", "01", "3"],
+        Path("D:/andrewscott_02_1.wav"): ["andrewscott", "02", "1"],
+        Path("D:/andrewscott_02_2.wav"): ["andrewscott", "02", "2"],
+        Path("D:/andrewscott_06_1.wav"): ["andrewscott", "06", "1"],
+        Path("D:/andrewscott_06_4.wav"): ["andrewscott", "06", "4"],
+        Path("A:/made_up/gunshot 5m 1"): ["gunshot", "5m", "1"],
+        Path("A:/made_up/gunshot 5m 2"): ["gunshot", "5m", "2"],
+        Path("A:/made_up/gunshot 10m 1"): ["gunshot", "10m", "1"],
+        Path("A:/made_up/gunshot 10m 2"): ["gunshot", "10m", "2"],
+        Path("A:/made_up/waterfall 5m"): ["waterfall", "5m"],
+        Path("A:/made_up/waterfall 15m"): ["waterfall", "15m"],
+    }
+
+    assert utils.group_files_by_variation(data) == (
+        utils.find_files_with_variations(data)
+    )
+
+    # variations with another name sorted between them are still found
+    data = {
+        Path("D:/door_1.wav"): ["door", "1"],
+        Path("D:/door_1_alt.wav"): ["door", "1", "alt"],
+        Path("D:/door_2.wav"): ["door", "2"],
+        Path("D:/door_2_alt.wav"): ["door", "2", "alt"],
+        Path("D:/other/door_3.wav"): ["door", "3"],
+    }
+
+    assert utils.find_files_with_variations(data) == []
+    assert utils.group_files_by_variation(data) == [
+        [Path("D:/door_1.wav"), Path("D:/door_2.wav")],
+        [Path("D:/door_1_alt.wav"), Path("D:/door_2_alt.wav")],
+    ]
+
+    # files that only differ by their separator aren't variations of each other
+    same_number = [Path("D:/sfx/foo_01.wav"), Path("D:/sfx/foo-01.wav")]
+    tokens = utils.split_paths_to_tokens(same_number)
+    assert utils.group_files_by_variation(tokens) == []
+
+    tokens = utils.split_paths_to_tokens([*same_number, Path("D:/sfx/foo_02.wav")])
+    groups = utils.group_files_by_variation(tokens)
+    assert groups == [[Path("D:/sfx/foo_01.wav"), Path("D:/sfx/foo_02.wav")]]
+    assert utils.clean_output_name(groups[0]) == Path("D:/sfx/foo.wav")
+
+
 def test_add_file_tag():
     file = Path(
         "D:/Documents/Programming_stuff/Python_projects/Sausage file converter/IN/andrewscott_02_02.wav"
@@ -289,6 +467,158 @@ def test_create_default_path():
     )
 
 
+def test_plan_copy_jobs():
+    root = Path("/library")
+    grouped = [
+        [root / "impacts" / "metal_01.wav", root / "impacts" / "metal_02.wav"],
+        [root / "a" / "b" / "wood_01.wav", root / "a" / "b" / "wood_02.wav"],
+    ]
+    files_to_copy = [
+        root / "impacts" / "single.wav",
+        root / "impacts" / "readme.txt",
+        root / "a",
+        root / "a" / "b",
+        root / "a" / "notes.txt",
+        root / "a" / "clean",
+        root / "a" / "clean" / "one.wav",
+        root / "a" / "clean" / "deeper",
+        root / "a" / "clean" / "deeper" / "two.wav",
+        root / "whooshes",
+        root / "whooshes" / "swish.wav",
+        root / "top.txt",
+    ]
+
+    unique = utils.find_files_without_variations(grouped, files_to_copy)
+    assert unique == files_to_copy
+
+    out = utils.plan_copy_jobs(files_to_copy, grouped, root)
+    assert out == [
+        root / "impacts" / "single.wav",
+        root / "impacts" / "readme.txt",
+        root / "a" / "notes.txt",
+        root / "a" / "clean",
+        root / "whooshes",
+        root / "top.txt",
+    ]
+
+
+def test_copy_engine(tmp_path):
+    in_folder = tmp_path / "in"
+    out_folder = tmp_path / "out"
+    (in_folder / "folder" / "sub").mkdir(parents=True)
+    (in_folder / "folder" / "sub" / "a.wav").write_bytes(b"a" * 1000)
+    (in_folder / "b.txt").write_text("b")
+    (in_folder / "c.wav").write_bytes(b"c")
+    # a time well in the past, copies keep it
+    os.utime(in_folder / "folder" / "sub" / "a.wav", (1_000_000_000, 1_000_000_000))
+    os.utime(in_folder / "b.txt", (1_000_000_000, 1_000_000_000))
+
+    engine = copier.CopyEngine(in_folder, out_folder, max_workers=4, max_in_flight=2)
+    engine.submit(in_folder / "folder")
+    engine.submit(in_folder / "b.txt")
+    engine.submit(in_folder / "missing.wav")
+    # jobs can still be added while the others are copying
+    engine.submit(in_folder / "c.wav")
+    engine.close()
+
+    results = {r.source.name: r for r in engine.collect(block=True)}
+    assert engine.outstanding() == 0
+    assert len(results) == 4
+
+    assert results["missing.wav"].error is not None
+    assert results["b.txt"].destination == out_folder / "b.txt"
+    assert (out_folder / "folder" / "sub" / "a.wav").read_bytes() == b"a" * 1000
+    assert (out_folder / "b.txt").read_text() == "b"
+    assert (out_folder / "c.wav").read_bytes() == b"c"
+    assert (out_folder / "folder" / "sub" / "a.wav").stat().st_mtime == 1_000_000_000
+    assert (out_folder / "b.txt").stat().st_mtime == 1_000_000_000
+
+
+def test_copy_file_fallbacks(tmp_path, monkeypatch):
+    src = Path("tests/files/diffchannels/channels_test_file_01.wav")
+    original = src.read_bytes()
+
+    # every method the platform supports
+    copier.copy_file(src, tmp_path / "fast.wav")
+    assert (tmp_path / "fast.wav").read_bytes() == original
+
+    def unsupported(*args, **kwargs):
+        raise OSError(errno.EXDEV, "unsupported")
+
+    # no reflinks or copy_file_range, so sendfile
+    monkeypatch.setattr(copier, "_reflink", lambda fsrc, fdst: False)
+    monkeypatch.setattr(copier.os, "copy_file_range", unsupported, raising=False)
+    copier.copy_file(src, tmp_path / "sendfile.wav")
+    assert (tmp_path / "sendfile.wav").read_bytes() == original
+
+    # nothing from the kernel, the buffered copy
+    monkeypatch.setattr(copier.os, "sendfile", unsupported, raising=False)
+    copier.copy_file(src, tmp_path / "buffered.wav")
+    assert (tmp_path / "buffered.wav").read_bytes() == original
+
+    for copy in ("fast.wav", "sendfile.wav", "buffered.wav"):
+        assert (tmp_path / copy).stat().st_mtime_ns == src.stat().st_mtime_ns
+
+
+def test_copy_engine_queues_jobs_by_device(tmp_path, monkeypatch):
+    in_folder = tmp_path / "in"
+    (in_folder / "a").mkdir(parents=True)
+    (in_folder / "b").mkdir(parents=True)
+    busy = [in_folder / "a" / f"{i}.wav" for i in range(10)]
+    idle = in_folder / "b" / "0.wav"
+    for file in [*busy, idle]:
+        file.write_bytes(b"x")
+
+    started = []
+    copying = []
+    most_copying = []
+    lock = threading.Lock()
+
+    def slow_copy(file, input_folder, output_folder):
+        with lock:
+            started.append(file)
+            copying.append(file)
+            most_copying.append(len([f for f in copying if f.parent.name == "a"]))
+        time.sleep(0.05)
+        with lock:
+            copying.remove(file)
+        return output_folder / file.name
+
+    monkeypatch.setattr(copier, "copy_path", slow_copy)
+    # out/a and out/b are on different devices
+    monkeypatch.setattr(copier, "device_of", lambda path: path.name)
+
+    engine = copier.CopyEngine(
+        in_folder, tmp_path / "out", max_workers=4, device_workers=2
+    )
+    for file in [*busy, idle]:
+        engine.submit(file)
+    engine.close()
+
+    results = list(engine.collect(block=True))
+    assert len(results) == 11
+    assert all(result.error is None for result in results)
+
+    # device a's jobs wait in its queue instead of taking every thread, so device b's job starts straight away
+    assert max(most_copying) == 2
+    assert started.index(idle) <= 2
+
+
+def test_copy_engine_cancel(tmp_path):
+    in_folder = tmp_path / "in"
+    in_folder.mkdir()
+    (in_folder / "a.wav").write_bytes(b"a")
+
+    engine = copier.CopyEngine(in_folder, tmp_path / "out")
+    engine.cancel()
+    engine.submit(in_folder / "a.wav")
+    engine.close()
+
+    results = list(engine.collect(block=True))
+    assert results[0].cancelled
+    assert not (tmp_path / "out" / "a.wav").exists()
+
+
 def test_remove_too_long_files():
     w = worker.Worker(ctrl={"break": False})
 
@@ -1,8 +1,19 @@
 from src import worker
+from src import render
+from src import metadata_v2
+from src import probe
+from src import manifest
+from src import journal
+from src import resample
+from src import channel_layouts
+from src import loudness
 from pathlib import Path
 import soundfile as sf
 import numpy as np
 import pytest
+import pickle
+import shutil
+import tracemalloc
 
 
 def test_file_append_different_sample_rates():
@@ -91,3 +102,670 @@ def test_non_audio_or_empty():
             output_folder,
             append_tag,
         )
+
+
+def test_render_variation_group_result_record(tmp_path):
+    single_variation_list = [
+        Path("tests/files/diffchannels/channels_test_file_01.wav"),
+        Path("tests/files/diffchannels/channels_test_file_02.wav"),
+    ]
+    settings = render.RenderSettings(
+        silence_duration=0.5,
+        input_folder=Path("tests/files/diffchannels"),
+        output_folder=tmp_path,
+        append_tag="_sausage",
+    )
+
+    reportobj = render.render_variation_group(single_variation_list, settings)
+
+    assert reportobj.error is None
+    assert reportobj.new_file_name_path == tmp_path / "channels_test_file_sausage.wav"
+    assert reportobj.sample_rates == [96000, 96000]
+    assert reportobj.channels_list == [1, 2]
+
+    # the result record is sent back from a worker process, so it has to survive pickling
+    assert pickle.loads(pickle.dumps(reportobj)).new_file_name_path == (
+        reportobj.new_file_name_path
+    )
+
+
+def test_render_variation_group_stores_error(tmp_path):
+    single_variation_list = [
+        Path("tests/files/notaudio/notaudiofile_1.wav"),
+        Path("tests/files/notaudio/notaudiofile_2.wav"),
+    ]
+    settings = render.RenderSettings(
+        silence_duration=0.5,
+        input_folder=Path("tests/files/notaudio"),
+        output_folder=tmp_path,
+        append_tag="",
+    )
+
+    reportobj = render.render_variation_group(single_variation_list, settings)
+
+    assert isinstance(reportobj.error, sf.LibsndfileError)
+    assert reportobj.new_file_name_path is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_file_append_streams_in_blocks(tmp_path):
+    # a tiny block size has to give the same output as reading in one go
+    single_variation_list = [
+        Path("tests/files/diffsamplerate/test_file_48.wav"),
+        Path("tests/files/diffsamplerate/test_file_96.wav"),
+    ]
+    input_folder = Path("tests/files/diffsamplerate")
+
+    outputs = []
+    for blocksize in (333, 1_000_000):
+        output_folder = tmp_path / str(blocksize)
+        reportobj = render.ReportObject(single_variation_list)
+        outputs.append(
+            render.file_append(
+                reportobj, 0.5, input_folder, output_folder, "", blocksize=blocksize
+            )
+        )
+
+    small_blocks, one_block = (sf.read(output)[0] for output in outputs)
+
+    # 48k file resampled to 96k + half a second of silence + 96k file
+    assert len(small_blocks) == 2918 * 2 + 48000 + 5836
+    assert np.allclose(small_blocks, one_block)
+
+
+def test_file_append_matching_formats_is_bit_exact(tmp_path):
+    # two PCM_24 stereo 96k files, no conversion is needed so samples must come out untouched
+    shutil.copy(
+        "tests/files/diffchannels/channels_test_file_02.wav", tmp_path / "a_01.wav"
+    )
+    shutil.copy("tests/files/abc.wav", tmp_path / "b.wav")
+    mono, samplerate = sf.read(tmp_path / "b.wav", dtype="int32")
+    sf.write(
+        tmp_path / "a_02.wav",
+        np.column_stack((mono, -mono)),
+        samplerate,
+        subtype="PCM_24",
+    )
+
+    single_variation_list = [tmp_path / "a_01.wav", tmp_path / "a_02.wav"]
+    reportobj = render.ReportObject(single_variation_list)
+
+    output = render.file_append(
+        reportobj, 0.25, tmp_path, tmp_path / "out", "", blocksize=1000
+    )
+
+    first, _ = sf.read(single_variation_list[0], dtype="int32")
+    second, _ = sf.read(single_variation_list[1], dtype="int32")
+    silence = np.zeros((int(samplerate * 0.25), 2), dtype="int32")
+
+    written, _ = sf.read(output, dtype="int32")
+    assert sf.info(output).subtype == "PCM_24"
+    assert np.array_equal(written, np.concatenate((first, silence, second)))
+
+
+def test_file_append_target_format_converts_mixed_bit_depths(tmp_path):
+    rng = np.random.default_rng(0)
+    sf.write(
+        tmp_path / "a_01.wav",
+        rng.uniform(-0.5, 0.5, (4800, 2)),
+        48000,
+        subtype="PCM_24",
+    )
+    sf.write(
+        tmp_path / "a_02.wav",
+        rng.uniform(-0.5, 0.5, (4410, 1)),
+        44100,
+        subtype="PCM_16",
+    )
+    single_variation_list = [tmp_path / "a_01.wav", tmp_path / "a_02.wav"]
+
+    with pytest.raises(render.exceptions.BitDepthError):
+        render.file_append(
+            render.ReportObject(single_variation_list),
+            0.5,
+            tmp_path,
+            tmp_path / "out",
+            "",
+        )
+
+    reportobj = render.ReportObject(single_variation_list)
+    output = render.file_append(
+        reportobj,
+        0.5,
+        tmp_path,
+        tmp_path / "out",
+        "",
+        target_samplerate=96000,
+        target_subtype="PCM_16",
+        target_channels=2,
+        dither=True,
+    )
+
+    info = sf.info(output)
+    assert (info.samplerate, info.subtype, info.channels) == (96000, "PCM_16", 2)
+    assert info.frames == 9600 + 48000 + 9600
+    assert (reportobj.samplerate, reportobj.subtype, reportobj.channels) == (
+        96000,
+        "PCM_16",
+        2,
+    )
+    assert reportobj.subtypes == ["PCM_24", "PCM_16"]
+
+
+def test_channel_layout_matrices():
+    # mono is copied to both sides like before
+    assert np.array_equal(channel_layouts.layout_matrix(1, 2), [[1.0], [1.0]])
+
+    # ITU-R BS.775 5.1 to stereo, the LFE is left out
+    g = 1 / np.sqrt(2)
+    assert np.allclose(
+        channel_layouts.layout_matrix(6, 2),
+        [[1, 0, g, 0, g, 0], [0, 1, g, 0, 0, g]],
+    )
+
+    assert channel_layouts.mix_matrix(2, 2) is None
+    with pytest.raises(render.exceptions.ChannelCountError):
+        channel_layouts.mix_matrix(3, 2)
+
+    # a custom matrix is only used for variations with as many channels as it has columns
+    swap = [[0.0, 1.0], [1.0, 0.0]]
+    assert np.array_equal(channel_layouts.mix_matrix(2, 2, swap), swap)
+    assert np.array_equal(channel_layouts.mix_matrix(1, 2, swap), [[1.0], [1.0]])
+
+
+def test_file_append_mixes_surround_to_stereo(tmp_path):
+    rng = np.random.default_rng(0)
+    surround = rng.uniform(-0.1, 0.1, (4800, 6))
+    mono = rng.uniform(-0.1, 0.1, (4800, 1))
+    sf.write(tmp_path / "amb_01.wav", surround, 48000, subtype="FLOAT")
+    sf.write(tmp_path / "amb_02.wav", mono, 48000, subtype="FLOAT")
+    single_variation_list = [tmp_path / "amb_01.wav", tmp_path / "amb_02.wav"]
+
+    # without a target the output has the most channels of the group, mono goes to the centre
+    output = render.file_append(
+        render.ReportObject(single_variation_list), 0, tmp_path, tmp_path / "out", ""
+    )
+    written = sf.read(output)[0]
+    assert written.shape == (9600, 6)
+    assert np.allclose(written[4800:, 2], mono[:, 0], atol=1e-7)
+    assert not written[4800:, [0, 1, 3, 4, 5]].any()
+
+    output = render.file_append(
+        render.ReportObject(single_variation_list),
+        0,
+        tmp_path,
+        tmp_path / "stereo",
+        "",
+        target_channels=2,
+        blocksize=1000,
+    )
+    written = sf.read(output)[0]
+    expected = np.concatenate(
+        (
+            surround @ channel_layouts.layout_matrix(6, 2).T,
+            np.repeat(mono, 2, axis=1),
+        )
+    )
+    assert np.allclose(written, expected, atol=1e-7)
+
+    # a custom matrix that keeps only the centre of the 5.1 variation sets the output channel count
+    centre = [[0, 0, 1, 0, 0, 0]]
+    output = render.file_append(
+        render.ReportObject(single_variation_list),
+        0,
+        tmp_path,
+        tmp_path / "centre",
+        "",
+        channel_matrix=centre,
+    )
+    written = sf.read(output, always_2d=True)[0]
+    assert written.shape == (9600, 1)
+    assert np.allclose(written[:4800, 0], surround[:, 2], atol=1e-7)
+    assert np.allclose(written[4800:, 0], mono[:, 0], atol=1e-7)
+
+
+def test_dither_when_reducing_bit_depth(tmp_path):
+    # a constant 0.3 of a 16 bit step, rounds to silence without dither
+    step = 2.0**-15
+    sf.write(
+        tmp_path / "quiet_01.wav",
+        np.full((96000, 1), 0.3 * step),
+        48000,
+        subtype="PCM_24",
+    )
+    shutil.copy(tmp_path / "quiet_01.wav", tmp_path / "quiet_02.wav")
+    single_variation_list = [tmp_path / "quiet_01.wav", tmp_path / "quiet_02.wav"]
+
+    def render_16_bit(dither):
+        output = render.file_append(
+            render.ReportObject(single_variation_list),
+            0,
+            tmp_path,
+            tmp_path / f"out_{dither}",
+            "",
+            target_subtype="PCM_16",
+            dither=dither,
+        )
+        return sf.read(output, dtype="int16")[0]
+
+    assert not render_16_bit(False).any()
+
+    # TPDF dither keeps the level on average and moves samples at most one step either side of rounding
+    dithered = render_16_bit(True)
+    assert abs(dithered.mean() - 0.3) < 0.02
+    assert dithered.min() >= -1 and dithered.max() <= 1
+
+
+def test_long_silence_reuses_one_block(tmp_path):
+    rng = np.random.default_rng(0)
+    sf.write(tmp_path / "gap_01.wav", rng.uniform(-0.5, 0.5, (4800, 1)), 48000)
+    sf.write(tmp_path / "gap_02.wav", rng.uniform(-0.5, 0.5, (4800, 2)), 48000)
+    single_variation_list = [tmp_path / "gap_01.wav", tmp_path / "gap_02.wav"]
+
+    # 2 minutes of float64 stereo silence would be 92MB as one array
+    tracemalloc.start()
+    output = render.file_append(
+        render.ReportObject(single_variation_list), 120, tmp_path, tmp_path / "out", ""
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < 16 * 1024 * 1024
+    assert sf.info(output).frames == 4800 + 120 * 48000 + 4800
+
+    block = render._silence_block(1000, 2, "float64")
+    assert block is render._silence_block(500, 2, "float64")
+    assert not block.flags.writeable
+    assert not block.any()
+
+
+def tone(seconds, amplitude, samplerate=48000, channels=1):
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    return np.repeat(
+        (amplitude * np.sin(2 * np.pi * 997 * t))[:, None], channels, axis=1
+    )
+
+
+def test_loudness_of_reference_tones():
+    # a 997Hz sine at -20dBFS in one channel is -23 LUFS, in two it is -20 LUFS
+    mono = loudness.measure([tone(5, 0.1)], 48000, 1)
+    assert mono["integrated_lufs"] == pytest.approx(-23.01, abs=0.01)
+    assert mono["peak_dbfs"] == pytest.approx(-20, abs=0.01)
+    assert mono["rms_dbfs"] == pytest.approx(-23.01, abs=0.01)
+
+    stereo = loudness.measure([tone(5, 0.1, channels=2)], 48000, 2)
+    assert stereo["integrated_lufs"] == pytest.approx(-20.0, abs=0.01)
+
+    # blocks of any size give the same result
+    signal = tone(5, 0.1, 44100)
+    blocks = [signal[i : i + 1000] for i in range(0, len(signal), 1000)]
+    assert loudness.measure(blocks, 44100, 1)["integrated_lufs"] == pytest.approx(
+        loudness.measure([signal], 44100, 1)["integrated_lufs"]
+    )
+
+    # silence is below the absolute gate and a much quieter part is below the relative gate
+    analyser = loudness.Analyser(48000, 1)
+    analyser.add(tone(5, 0.1))
+    analyser.add_silence(48000 * 10)
+    analyser.add(tone(5, 0.001))
+    assert analyser.output.result()["integrated_lufs"] == pytest.approx(-23, abs=0.2)
+
+    # shorter than one 400ms block
+    assert loudness.measure([tone(0.3, 0.1)], 48000, 1)["integrated_lufs"] is None
+
+
+def test_file_append_measures_loudness(tmp_path):
+    sf.write(tmp_path / "hum_01.wav", tone(2, 0.1), 48000, subtype="PCM_24")
+    sf.write(tmp_path / "hum_02.wav", tone(2, 0.5), 48000, subtype="PCM_24")
+    single_variation_list = [tmp_path / "hum_01.wav", tmp_path / "hum_02.wav"]
+
+    reportobj = render.ReportObject(single_variation_list)
+    output = render.file_append(
+        reportobj,
+        1,
+        tmp_path,
+        tmp_path / "out",
+        "",
+        blocksize=5000,
+        measure_loudness=True,
+    )
+
+    # measured while writing, the same as measuring the file afterwards
+    written, samplerate = sf.read(output, always_2d=True)
+    measured = loudness.measure([written], samplerate, 1)
+    for key in ("peak_dbfs", "rms_dbfs", "integrated_lufs"):
+        assert reportobj.loudness[key] == pytest.approx(measured[key], abs=0.01)
+
+    first, second = reportobj.variation_loudness
+    assert first["integrated_lufs"] == pytest.approx(-23.01, abs=0.01)
+    assert second["peak_dbfs"] == pytest.approx(20 * np.log10(0.5), abs=0.01)
+    assert reportobj.gains_db == []
+
+    # both variations are brought to -30 LUFS
+    reportobj = render.ReportObject(single_variation_list)
+    render.file_append(
+        reportobj,
+        1,
+        tmp_path,
+        tmp_path / "quiet",
+        "",
+        measure_loudness=True,
+        normalise_lufs=-30,
+    )
+    levels = [v["integrated_lufs"] for v in reportobj.variation_loudness]
+    assert levels == pytest.approx([-30, -30], abs=0.05)
+
+    # a full scale sine is -3 LUFS, so -1 LUFS is limited to the peak
+    reportobj = render.ReportObject(single_variation_list)
+    render.file_append(
+        reportobj,
+        1,
+        tmp_path,
+        tmp_path / "loud",
+        "",
+        measure_loudness=True,
+        normalise_lufs=-1,
+    )
+    for variation in reportobj.variation_loudness:
+        assert variation["peak_dbfs"] == pytest.approx(0, abs=0.01)
+        assert variation["integrated_lufs"] == pytest.approx(-3.01, abs=0.05)
+    assert reportobj.gains_db[0] == pytest.approx(20, abs=0.01)
+
+    # not measured unless it's asked for, the gains normalising applied are still kept
+    reportobj = render.ReportObject(single_variation_list)
+    render.file_append(
+        reportobj, 1, tmp_path, tmp_path / "unmeasured", "", normalise_lufs=-30
+    )
+    assert reportobj.loudness is None
+    assert reportobj.variation_loudness == []
+    assert reportobj.gains_db == pytest.approx([-6.99, -20.97], abs=0.01)
+
+
+def test_normalise_mixed_channels_and_samplerates(tmp_path):
+    # measured after they are mixed and resampled to the output, so mono upmixed to stereo isn't 3dB over
+    sf.write(tmp_path / "hum_01.wav", tone(2, 0.1, 44100), 44100, subtype="PCM_24")
+    sf.write(tmp_path / "hum_02.wav", tone(2, 0.5, channels=2), 48000, subtype="PCM_24")
+    single_variation_list = [tmp_path / "hum_01.wav", tmp_path / "hum_02.wav"]
+
+    reportobj = render.ReportObject(single_variation_list)
+    output = render.file_append(
+        reportobj,
+        1,
+        tmp_path,
+        tmp_path / "out",
+        "",
+        measure_loudness=True,
+        normalise_lufs=-30,
+    )
+
+    levels = [v["integrated_lufs"] for v in reportobj.variation_loudness]
+    assert levels == pytest.approx([-30, -30], abs=0.05)
+
+    # each variation measured again from the written file
+    written, samplerate = sf.read(output, always_2d=True)
+    assert written.shape[1] == 2
+    first = loudness.measure([written[: 2 * samplerate]], samplerate, 2)
+    second = loudness.measure([written[3 * samplerate :]], samplerate, 2)
+    assert first["integrated_lufs"] == pytest.approx(-30, abs=0.05)
+    assert second["integrated_lufs"] == pytest.approx(-30, abs=0.05)
+
+
+def test_file_append_writes_metadata_in_the_same_pass(tmp_path):
+    shutil.copy("tests/files/Reaper_Metadata.wav", tmp_path / "reaper_01.wav")
+    shutil.copy("tests/files/Reaper_Metadata.wav", tmp_path / "reaper_02.wav")
+
+    single_variation_list = [tmp_path / "reaper_01.wav", tmp_path / "reaper_02.wav"]
+    reportobj = render.ReportObject(single_variation_list)
+
+    output = render.file_append(reportobj, 0.5, tmp_path, tmp_path / "out", "")
+
+    with open("tests/files/Reaper_Metadata.wav", "rb") as f:
+        original_md = metadata_v2.Metadata_Parser(f, lazy=True)
+
+    with open(output, "rb") as f:
+        new_md = metadata_v2.Metadata_Parser(f, lazy=True)
+
+    assert new_md.generic_metadata == original_md.generic_metadata
+    assert new_md.header_info["file_size"] == output.stat().st_size - 8
+    assert sf.info(output).frames == 9508 * 2 + 24000
+
+
+def test_probe_properties_match_libsndfile(tmp_path):
+    files = sorted(Path("tests/files").glob("**/*.wav"))
+
+    # a flac has no RIFF headers, so it is left to libsndfile
+    flac = tmp_path / "sound.flac"
+    sf.write(flac, np.zeros((4800, 2)), 48000)
+    files.append(flac)
+
+    cache = probe.PropertiesCache()
+    for file, properties in cache.probe_all(files, max_workers=4):
+        try:
+            info = sf.info(file)
+        except sf.LibsndfileError:
+            assert properties is None, file
+            continue
+
+        assert (
+            properties.samplerate,
+            properties.channels,
+            properties.subtype,
+            properties.frames,
+        ) == (info.samplerate, info.channels, info.subtype, info.frames), file
+        assert properties.duration == info.frames / info.samplerate
+
+    # a file that was never finished has less audio than its data chunk says
+    source = Path("tests/files/diffchannels/channels_test_file_01.wav").read_bytes()
+    truncated = tmp_path / "truncated.wav"
+    truncated.write_bytes(source[: len(source) // 2])
+    properties = probe.properties(truncated)
+    assert properties.data_offset + properties.data_size <= len(source) // 2
+    assert probe.duration(truncated) < probe.duration(
+        Path("tests/files/diffchannels/channels_test_file_01.wav")
+    )
+
+
+def test_properties_cache_reprobes_changed_files(tmp_path):
+    file = tmp_path / "sound.wav"
+    sf.write(file, np.zeros((4800, 1)), 48000)
+
+    cache = probe.PropertiesCache()
+    first = cache.get(file)
+    assert cache.get(file) is first
+
+    sf.write(file, np.zeros((9600, 1)), 48000)
+    assert cache.get(file).frames == 9600
+
+
+def test_render_length_matches_output(tmp_path):
+    files = [
+        Path("tests/files/diffsamplerate/test_file_48.wav"),
+        Path("tests/files/diffsamplerate/test_file_96.wav"),
+    ]
+    settings = render.RenderSettings(
+        silence_duration=0.5,
+        input_folder=Path("tests/files/diffsamplerate"),
+        output_folder=tmp_path,
+        append_tag="",
+    )
+    properties = [probe.properties(file) for file in files]
+
+    reportobj = render.render_variation_group(files, settings, properties)
+    assert reportobj.error is None
+
+    info = sf.info(reportobj.new_file_name_path)
+    assert reportobj.length == info.frames / info.samplerate
+
+
+@pytest.mark.parametrize("quality", ["QQ", "LQ", "MQ", "HQ", "VHQ"])
+def test_render_resample_qualities(tmp_path, quality):
+    files = [
+        Path("tests/files/diffsamplerate/test_file_48.wav"),
+        Path("tests/files/diffsamplerate/test_file_96.wav"),
+    ]
+    settings = render.RenderSettings(
+        silence_duration=0.5,
+        input_folder=Path("tests/files/diffsamplerate"),
+        output_folder=tmp_path,
+        append_tag="",
+        resample_quality=quality,
+    )
+
+    reportobj = render.render_variation_group(files, settings)
+    assert reportobj.error is None
+
+    info = sf.info(reportobj.new_file_name_path)
+    assert info.samplerate == 96000
+    expected = sum(
+        round(sf.info(file).frames * 96000 / sf.info(file).samplerate) for file in files
+    )
+    assert info.frames == expected + 48000
+
+
+def test_resample_stream_is_reused_cleared():
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, (4800, 2))
+
+    def run():
+        stream = resample.stream(48000, 96000, 2, "float64", "HQ")
+        out = stream.resample_chunk(audio)
+        return stream, np.concatenate(
+            [out, stream.resample_chunk(audio[:0], last=True)]
+        )
+
+    resample.clear_cache()
+    first_stream, first = run()
+    second_stream, second = run()
+
+    assert first_stream is second_stream
+    assert np.array_equal(first, second)
+
+    with pytest.raises(ValueError):
+        resample.stream(48000, 96000, 2, "float64", "best")
+
+
+def test_manifest_finds_unchanged_outputs(tmp_path):
+    in_folder = tmp_path / "in"
+    in_folder.mkdir()
+    files = []
+    for name in ("metal_01.wav", "metal_02.wav"):
+        shutil.copy(
+            "tests/files/diffchannels/channels_test_file_01.wav", in_folder / name
+        )
+        files.append(in_folder / name)
+
+    out_folder = tmp_path / "out"
+    settings = render.RenderSettings(
+        silence_duration=0.5,
+        input_folder=in_folder,
+        output_folder=out_folder,
+        append_tag="",
+    )
+    reportobj = render.render_variation_group(files, settings)
+    output = reportobj.new_file_name_path
+    assert output == render.output_path(files, in_folder, out_folder, "")
+
+    saved = manifest.Manifest(out_folder)
+    manifest_settings = manifest.Manifest.settings(settings, 0)
+    sources = [manifest.fingerprint(file) for file in files]
+    saved.record(output, sources, manifest_settings)
+    saved.save()
+
+    loaded = manifest.Manifest(out_folder)
+    loaded.load()
+    assert loaded.is_up_to_date(output, sources, manifest_settings)
+
+    # different settings
+    settings.silence_duration = 1.0
+    assert not loaded.is_up_to_date(
+        output, sources, manifest.Manifest.settings(settings, 0)
+    )
+    assert not loaded.is_up_to_date(
+        output, sources, {**manifest_settings, "max_duration": 5}
+    )
+
+    # a source changed
+    with open(files[1], "ab") as f:
+        f.write(b"\x00\x00")
+    assert not loaded.is_up_to_date(
+        output, [manifest.fingerprint(file) for file in files], manifest_settings
+    )
+
+    # output removed
+    output.unlink()
+    assert not loaded.is_up_to_date(output, sources, manifest_settings)
+
+    # a broken manifest is ignored
+    (out_folder / manifest.MANIFEST_NAME).write_text("{not json")
+    broken = manifest.Manifest(out_folder)
+    broken.load()
+    assert broken.outputs == {}
+
+
+def test_journal_resumes_finished_groups(tmp_path):
+    saved = journal.Journal(tmp_path)
+    saved.open()
+    saved.pending("a.wav", [Path("a_01.wav"), Path("a_02.wav")])
+    saved.pending("b.wav", [Path("b_01.wav"), Path("b_02.wav")])
+    saved.pending("c.wav", [Path("c_01.wav"), Path("c_02.wav")])
+    saved.done("a.wav", {"sources": [], "settings": {}, "output": []})
+    saved.failed("b.wav", "error")
+    saved.close()
+
+    # a crash part way through writing a line
+    with open(saved.path, "a") as f:
+        f.write('{"state": "done", "output": "c.w')
+
+    resumed = journal.Journal(tmp_path)
+    assert resumed.done_entries() == {
+        "a.wav": {"sources": [], "settings": {}, "output": []}
+    }
+
+    # queued again in the resumed run, so no longer done
+    resumed.open(resume=True)
+    resumed.pending("a.wav", [Path("a_01.wav"), Path("a_02.wav")])
+    resumed.close()
+    assert resumed.done_entries() == {}
+
+    resumed.remove()
+    assert not resumed.path.exists()
+
+
+def test_journal_syncs_in_batches(tmp_path, monkeypatch):
+    syncs = []
+    monkeypatch.setattr(journal.os, "fsync", syncs.append)
+
+    saved = journal.Journal(tmp_path)
+    saved.open()
+    for i in range(1000):
+        saved.pending(f"{i}.wav", [Path(f"{i}_01.wav"), Path(f"{i}_02.wav")])
+    saved.sync()
+    assert len(syncs) == 1
+
+    for i in range(journal.SYNC_LINES * 2):
+        saved.done(f"{i}.wav", {"sources": [], "settings": {}, "output": []})
+    assert len(syncs) == 3
+
+    saved.failed("999.wav", "error")
+    saved.close()
+    assert len(syncs) == 4
+
+    unfinished = journal.Journal(tmp_path).unfinished()
+    assert len(unfinished) == 1000 - journal.SYNC_LINES * 2 - 1
+    assert "0.wav" not in unfinished and "999.wav" not in unfinished
+
+
+def test_failed_render_leaves_no_partial_output(tmp_path):
+    files = [
+        Path("tests/files/diffchannels/channels_test_file_01.wav"),
+        Path("tests/files/notaudio/notaudiofile_1.wav"),
+    ]
+    settings = render.RenderSettings(
+        silence_duration=0.5,
+        input_folder=Path("tests/files"),
+        output_folder=tmp_path,
+        append_tag="",
+    )
+
+    reportobj = render.render_variation_group(files, settings)
+    assert reportobj.error is not None
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
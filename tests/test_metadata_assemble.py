@@ -1,5 +1,6 @@
 from pathlib import Path
 import shutil
+import soundfile
 
 from src import metadata_v2
 
@@ -86,5 +87,30 @@ def test_assemble():
     test_validate_data()
 
 
+def test_assemble_appends_in_place(tmp_path):
+    """metadata is appended after the new file's data chunk and the audio is left untouched"""
+    original = Path(r"tests/files/Reaper_Metadata.wav")
+    new_file = tmp_path / "new.wav"
+
+    data, samplerate = soundfile.read(r"tests/files/abc.wav", dtype="int32")
+    soundfile.write(new_file, data, samplerate, subtype="PCM_24")
+
+    md = metadata_v2.Metadata_Assembler(
+        original_filename=original, new_filename=new_file
+    )
+    md.assemble()
+
+    with open(new_file, "rb") as f:
+        new_md = metadata_v2.Metadata_Parser(f)
+
+    with open(original, "rb") as f:
+        original_md = metadata_v2.Metadata_Parser(f)
+
+    assert new_md.header_info["file_size"] == new_file.stat().st_size - 8
+    assert new_md.generic_metadata_info == original_md.generic_metadata_info
+    assert new_md.data_info["sub_chunk_size"] == len(data) * 3
+    assert (soundfile.read(new_file, dtype="int32")[0] == data).all()
+
+
 if __name__ == "__main__":
     test_assemble()
@@ -83,5 +83,52 @@ def test_read_generic_metadata():
     }
 
 
+def test_lazy_parser_matches_full_read():
+    """a lazy parser gives the same info as a full read without reading the audio"""
+    test_file = Path(r"tests/files/Reaper_Metadata.wav")
+
+    with open(test_file, "rb") as f:
+        md = metadata_v2.Metadata_Parser(f)
+
+    with open(test_file, "rb") as f:
+        lazy_md = metadata_v2.Metadata_Parser(f, lazy=True)
+
+    assert lazy_md.data is None
+    assert lazy_md.header_info == md.header_info
+    assert lazy_md.fmt_info == md.fmt_info
+    assert lazy_md.data_info == md.data_info
+    assert lazy_md.generic_metadata_info == md.generic_metadata_info
+    assert lazy_md.generic_metadata == md.generic_metadata
+    assert lazy_md.chunks == md.chunks
+
+
+def test_chunk_index():
+    test_file = Path(r"tests/files/Reaper_Metadata.wav")
+
+    with open(test_file, "rb") as f:
+        file_bytes = f.read()
+        md = metadata_v2.Metadata_Parser(f, lazy=True)
+
+    assert [chunk[0] for chunk in md.chunks] == [
+        b"fmt ",
+        b"acid",
+        b"bext",
+        b"iXML",
+        b"_PMX",
+        b"cart",
+        b"id3 ",
+        b"junk",
+        b"data",
+        b"LIST",
+    ]
+
+    for sub_chunk_id, offset, sub_chunk_size in md.chunks:
+        # the size field is stored in the 4 bytes before the content
+        assert file_bytes[offset - 8 : offset - 4] == sub_chunk_id
+        assert md.chunk(sub_chunk_id) == file_bytes[offset : offset + sub_chunk_size]
+
+    assert md.chunk(b"nope") is None
+
+
 if __name__ == "__main__":
     test_read_generic_metadata()